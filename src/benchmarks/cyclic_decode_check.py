@@ -0,0 +1,79 @@
+'''
+encode -> corrupt -> decode round trip of the cyclic codes, the same steps `CyclicMaster._decoding` takes:
+workers send R = W G in the coded dtype (complex64, or float32 for the real code), `s` of them add an
+adversarial error, master locates them and decodes the sum of the gradients with the recovery vector.
+Reports how often the adversaries are located and the relative error of the decoded sum, and exits
+with status 1 when the median error of a setting is above `--tol`
+
+    python benchmarks/cyclic_decode_check.py --workers=8,16,32 --worker-fail=1,2,5
+'''
+from __future__ import print_function
+
+import os
+import sys
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from coding import search_w, solve_poly_a, solve_poly_a_real, chebyshev_nodes, recovery_vector
+
+
+def _suspects(n, s, E, real):
+    '''workers the error locator points at, as in `CyclicMaster._decoding`'''
+    if real:
+        alpha = solve_poly_a_real(n=n, s=s, R=E)
+        x, _ = chebyshev_nodes(n)
+    else:
+        alpha = solve_poly_a(n=n, s=s, R=E)
+        x = np.exp(2*np.pi*np.arange(n)*1j/n)
+    poly_a = np.ones(s+1, dtype=alpha.dtype)
+    poly_a[0:s] = -alpha.reshape(-1)
+    estimation = np.absolute(np.dot(np.power(x[:, None], np.arange(s+1)[None, :]), poly_a))
+    return set(np.argsort(estimation, kind='mergesort')[:s])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='cyclic code round trip check')
+    parser.add_argument('--workers', type=str, default='8,16,32', help='comma separated worker counts n')
+    parser.add_argument('--worker-fail', type=str, default='1,2,5', help='comma separated adversary counts s')
+    parser.add_argument('--dim', type=int, default=1000, help='gradient dimension')
+    parser.add_argument('--trials', type=int, default=50, help='random steps per setting')
+    parser.add_argument('--tol', type=float, default=1e-3, help='largest acceptable median relative error')
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    failed = False
+    print("{:>7} {:>4} {:>3} {:>9} {:>12} {:>12} {:>10}".format(
+        "code", "n", "s", "located", "median err", "max err", "max |v|"))
+    for real in (False, True):
+        coded_dtype = np.float32 if real else np.complex64
+        for n in [int(x) for x in args.workers.split(',')]:
+            for s in [int(x) for x in args.worker_fail.split(',')]:
+                if n <= 2*s+1:
+                    continue
+                W, _, _, _, C_1 = search_w(n, s, real=real)
+                rand_factor = rng.normal(size=args.dim).astype(np.float32)
+                located, errors, max_v = 0, [], 0.0
+                for _ in range(args.trials):
+                    G = rng.normal(size=(n, args.dim))
+                    R = np.dot(W, G).astype(coded_dtype)
+                    adversaries = set(rng.choice(n, size=s, replace=False))
+                    for i in adversaries:
+                        R[i] += -100*rng.rand(args.dim).astype(np.float32)
+                    suspects = _suspects(n, s, np.dot(R, rand_factor), real)
+                    located += suspects == adversaries
+                    v = recovery_vector(C_1, [i for i in range(n) if i not in suspects])
+                    decoded = np.real(np.dot(v.astype(coded_dtype), R))
+                    expected = G.sum(axis=0)
+                    errors.append(np.linalg.norm(decoded-expected)/np.linalg.norm(expected))
+                    max_v = max(max_v, float(np.max(np.absolute(v))))
+                median_err = np.median(errors)
+                failed = failed or not median_err <= args.tol
+                print("{:>7} {:>4} {:>3} {:>9.3f} {:>12.2e} {:>12.2e} {:>10.2e}".format(
+                    "real" if real else "complex", n, s, located/float(args.trials), median_err, max(errors), max_v))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
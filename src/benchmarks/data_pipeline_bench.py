@@ -0,0 +1,103 @@
+'''
+training input pipeline throughput in images/s: the per-sample torchvision transform chain of
+`util.load_data` behind a `DataLoader` vs. the batch level `TensorBatchLoader` of `datasets.tensor_data`.
+`--synthetic` uses random uint8 images of the dataset's shape instead of downloading it
+
+    python benchmarks/data_pipeline_bench.py --dataset=Cifar10 --batch-size=128 --batches=100 --loader-workers=0,2
+'''
+from __future__ import print_function
+
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+from PIL import Image
+
+import torch
+import torch.nn.functional as F
+from torch.autograd import Variable
+from torch.utils import data
+from torchvision import transforms
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from datasets.tensor_data import TensorDataset, TensorBatchLoader, load_tensor_dataset, NORMALIZATION_
+
+_SHAPES = {"MNIST": (60000, 1, 28, 28), "Cifar10": (50000, 3, 32, 32)}
+
+
+def _legacy_transform(dataset):
+    '''the training transform `util.load_data` builds'''
+    mean, std = NORMALIZATION_[dataset]
+    if dataset == "MNIST":
+        return transforms.Compose([transforms.ToTensor(), transforms.Normalize(mean, std)])
+    return transforms.Compose([
+        transforms.ToTensor(),
+        transforms.Lambda(lambda x: F.pad(
+                            Variable(x.unsqueeze(0), requires_grad=False, volatile=True),
+                            (4,4,4,4),mode='reflect').data.squeeze()),
+        transforms.ToPILImage(),
+        transforms.RandomCrop(32),
+        transforms.RandomHorizontalFlip(),
+        transforms.ToTensor(),
+        transforms.Normalize(mean, std),
+        ])
+
+
+class _LegacyDataset(data.Dataset):
+    '''raw (N, C, H, W) uint8 images served through PIL and the transform, as torchvision's datasets do'''
+    def __init__(self, images, labels, transform):
+        self.images = images[:, 0] if images.shape[1] == 1 else images.transpose(0, 2, 3, 1)
+        self.labels = labels
+        self.transform = transform
+
+    def __len__(self):
+        return self.images.shape[0]
+
+    def __getitem__(self, idx):
+        mode = 'L' if self.images.ndim == 3 else None
+        return self.transform(Image.fromarray(self.images[idx], mode=mode)), int(self.labels[idx])
+
+
+def _throughput(loader, batches):
+    start = time.time()
+    num_images = 0
+    for batch_idx, (images, _) in enumerate(loader):
+        num_images += images.size(0)
+        if batch_idx+1 == batches:
+            break
+    return num_images/(time.time()-start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='input pipeline throughput benchmark')
+    parser.add_argument('--dataset', type=str, default='Cifar10', help='MNIST or Cifar10')
+    parser.add_argument('--data-dir', type=str, default='./cifar10_data', help='where the dataset is (downloaded)')
+    parser.add_argument('--synthetic', action='store_true', default=False, help='random images instead of the real dataset')
+    parser.add_argument('--batch-size', type=int, default=128, help='images per batch')
+    parser.add_argument('--batches', type=int, default=100, help='batches timed per pipeline')
+    parser.add_argument('--loader-workers', type=str, default='0,2', help='comma separated DataLoader process counts for the legacy pipeline')
+    args = parser.parse_args()
+
+    if args.synthetic:
+        rng = np.random.RandomState(0)
+        images = rng.randint(0, 256, size=_SHAPES[args.dataset]).astype(np.uint8)
+        labels = rng.randint(0, 10, size=images.shape[0]).astype(np.int64)
+        mean, std = NORMALIZATION_[args.dataset]
+        pad, flip = (4, True) if args.dataset == "Cifar10" else (0, False)
+        tensor_set = TensorDataset(images, labels, mean, std, pad=pad, flip=flip)
+    else:
+        tensor_set = load_tensor_dataset(args.dataset, args.data_dir, train=True)
+    legacy_set = _LegacyDataset(tensor_set.images, tensor_set.labels, _legacy_transform(args.dataset))
+
+    print("{:>28} {:>12}".format("pipeline", "images/s"))
+    for loader_workers in [int(x) for x in args.loader_workers.split(',')]:
+        loader = data.DataLoader(legacy_set, batch_size=args.batch_size, shuffle=True, num_workers=loader_workers)
+        print("{:>28} {:>12.0f}".format("torchvision ({} workers)".format(loader_workers), _throughput(loader, args.batches)))
+    loader = TensorBatchLoader(tensor_set, batch_size=args.batch_size, shuffle=True, seed=0)
+    print("{:>28} {:>12.0f}".format("tensor", _throughput(loader, args.batches)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+'''
+microbenchmark of the gradient gather loop on master: the legacy loop that calls `Waitany`
+once per message and rescans every layer counter afterwards vs. `GradientGatherer`.
+Workers send one dummy gradient per layer per step, run it with e.g.
+
+    mpirun -n 33 python benchmarks/gather_bench.py --num-layers=10,40,160 --steps=20
+'''
+from __future__ import print_function
+
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+from mpi4py import MPI
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from master.utils import GradientAccumulator, GradientGatherer
+
+
+def _fake_model(num_layers, layer_size):
+    return torch.nn.ParameterList([torch.nn.Parameter(torch.zeros(layer_size)) for _ in range(num_layers)])
+
+
+def _cpu_time():
+    t = os.times()
+    return t[0] + t[1]
+
+
+def _post_recvs(comm, accumulator, num_layers, num_workers):
+    requests = []
+    request_layers = []
+    for layer_idx in range(num_layers):
+        for k in range(num_workers):
+            requests.append(comm.Irecv([accumulator.gradient_aggregator[layer_idx][k], MPI.DOUBLE], source=k+1, tag=88+layer_idx))
+            request_layers.append((k+1, [layer_idx]))
+    return requests, request_layers
+
+
+def _legacy_gather(requests, accumulator, num_workers):
+    '''the receive loop masters used before `GradientGatherer`'''
+    enough_gradients_received = False
+    while not enough_gradients_received:
+        status = MPI.Status()
+        MPI.Request.Waitany(requests=requests, status=status)
+        layer_index = status.tag-88
+        if accumulator.gradient_aggregate_counter[layer_index] <= num_workers:
+            _ = accumulator.gradient_aggregator[layer_index][status.source-1]
+        accumulator.gradient_aggregate_counter[layer_index] += 1
+        enough_gradients_received = True
+        for j in accumulator.gradient_aggregate_counter:
+            enough_gradients_received = enough_gradients_received and (j >= num_workers)
+
+
+def _master(comm, args, num_layers):
+    num_workers = comm.Get_size()-1
+    accumulator = GradientAccumulator(_fake_model(num_layers, args.layer_size), num_workers, mode='None')
+    gatherer = GradientGatherer(accumulator, num_workers)
+    results = {}
+    for method in ("waitany", "waitsome"):
+        wall_cost = cpu_cost = 0.0
+        for step in range(args.steps+1):
+            accumulator.meset_everything()
+            requests, request_layers = _post_recvs(comm, accumulator, num_layers, num_workers)
+            comm.Barrier()
+            wall_start, cpu_start = time.time(), _cpu_time()
+            if method == "waitany":
+                _legacy_gather(requests, accumulator, num_workers)
+            else:
+                gatherer.gather(requests, request_layers, lambda layer_index, source, grad: None)
+            # the first step is a warm up
+            if step > 0:
+                wall_cost += time.time() - wall_start
+                cpu_cost += _cpu_time() - cpu_start
+        results[method] = (wall_cost/args.steps*1000, cpu_cost/args.steps*1000)
+    print("Workers: {}, Layers: {}, Waitany: {:.3f} ms (cpu {:.3f} ms), Waitsome: {:.3f} ms (cpu {:.3f} ms)".format(
+        num_workers, num_layers, results["waitany"][0], results["waitany"][1], results["waitsome"][0], results["waitsome"][1]))
+
+
+def _worker(comm, args, num_layers):
+    grad = np.ones(args.layer_size)
+    for _ in range(2*(args.steps+1)):
+        comm.Barrier()
+        req_send_check = [comm.Isend([grad, MPI.DOUBLE], dest=0, tag=88+layer_idx) for layer_idx in range(num_layers)]
+        MPI.Request.Waitall(req_send_check)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='gradient gather microbenchmark')
+    parser.add_argument('--num-layers', type=str, default='10,40,160',
+                        help='comma separated numbers of layers to benchmark')
+    parser.add_argument('--layer-size', type=int, default=64,
+                        help='number of float64 elements in every layer gradient')
+    parser.add_argument('--steps', type=int, default=20,
+                        help='number of timed steps for each setting')
+    args = parser.parse_args()
+
+    comm = MPI.COMM_WORLD
+    for num_layers in [int(l) for l in args.num_layers.split(',')]:
+        if comm.Get_rank() == 0:
+            _master(comm, args, num_layers)
+        else:
+            _worker(comm, args, num_layers)
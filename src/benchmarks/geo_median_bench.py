@@ -0,0 +1,76 @@
+'''
+microbenchmark of the geometric median on master: `hdmedians.geomedian` (what masters used before)
+vs. the Weiszfeld solver in `robust_aggregation`, cold and warm started, over random (n, d) gradient
+matrices. Accuracy is reported as the relative gap of the objective (sum of distances to the workers)
+
+    python benchmarks/geo_median_bench.py --workers=8,16,32 --dims=10000,100000,1000000
+'''
+from __future__ import print_function
+
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from robust_aggregation import weiszfeld
+
+try:
+    import hdmedians as hd
+except ImportError:
+    hd = None
+
+
+def _objective(grads, median):
+    return np.sqrt(np.sum(np.square(grads.astype(np.float64)-median), axis=1)).sum()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='geometric median microbenchmark')
+    parser.add_argument('--workers', type=str, default='8,16,32', help='comma separated worker counts')
+    parser.add_argument('--dims', type=str, default='10000,100000,1000000', help='comma separated gradient sizes')
+    parser.add_argument('--worker-fail', type=int, default=2, help='number of byzantine workers')
+    parser.add_argument('--dtype', type=str, default='float64', help='dtype of the gradients')
+    parser.add_argument('--tol', type=float, default=1e-6, help='Weiszfeld relative tolerance')
+    parser.add_argument('--max-iter', type=int, default=200, help='Weiszfeld maximum iterations')
+    parser.add_argument('--drift', type=float, default=0.05, help='relative change of the gradients between two steps for the warm start')
+    args = parser.parse_args()
+
+    if hd is None:
+        print("hdmedians is not installed, only timing the Weiszfeld solver")
+    rng = np.random.RandomState(0)
+    print("{:>4} {:>9} {:>10} {:>10} {:>6} {:>10} {:>6} {:>12} {:>12}".format(
+        "n", "d", "hd (s)", "cold (s)", "iters", "warm (s)", "iters", "cold gap", "warm gap"))
+    for d in [int(x) for x in args.dims.split(',')]:
+        for n in [int(x) for x in args.workers.split(',')]:
+            prev_grads = rng.randn(n, d).astype(args.dtype)
+            prev_grads[:args.worker_fail] *= -100
+            grads = (prev_grads + args.drift*rng.randn(n, d)).astype(args.dtype)
+            # the warm start comes from the previous step's median
+            prev_median, _ = weiszfeld([prev_grads], tol=args.tol, max_iter=args.max_iter)
+
+            start = time.time()
+            cold, cold_iters = weiszfeld([grads], tol=args.tol, max_iter=args.max_iter)
+            cold_time = time.time()-start
+            start = time.time()
+            warm, warm_iters = weiszfeld([grads], init=prev_median, tol=args.tol, max_iter=args.max_iter)
+            warm_time = time.time()-start
+
+            if hd is None:
+                print("{:>4} {:>9} {:>10} {:>10.4f} {:>6} {:>10.4f} {:>6} {:>12} {:>12}".format(
+                    n, d, "-", cold_time, cold_iters, warm_time, warm_iters, "-", "-"))
+                continue
+            start = time.time()
+            reference = np.array(hd.geomedian(np.array(grads), axis=0))
+            hd_time = time.time()-start
+            reference_objective = _objective(grads, reference)
+            cold_gap = (_objective(grads, cold[0])-reference_objective)/reference_objective
+            warm_gap = (_objective(grads, warm[0])-reference_objective)/reference_objective
+            print("{:>4} {:>9} {:>10.4f} {:>10.4f} {:>6} {:>10.4f} {:>6} {:>12.2e} {:>12.2e}".format(
+                n, d, hd_time, cold_time, cold_iters, warm_time, warm_iters, cold_gap, warm_gap))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+'''
+microbenchmark of Krum on master: the legacy per-pair loop of `np.linalg.norm(g_i-g_j)` vs.
+the Gram matrix version in `robust_aggregation`, over random (n, d) gradient matrices
+
+    python benchmarks/krum_bench.py --workers=8,16,32,64 --dims=100000,1000000,25557032
+
+25557032 is the number of parameters of ResNet-50, the largest sizes need a lot of memory
+(n*d floats), use `--skip-loop-above` to only time the Gram version there
+'''
+from __future__ import print_function
+
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from robust_aggregation import krum_select
+
+
+def _legacy_krum(grad_list, s):
+    '''the loop `SyncReplicasMaster_NN._krum` used before the Gram matrix version'''
+    score = []
+    for i, g_i in enumerate(grad_list):
+        neighbor_distances = []
+        for j, g_j in enumerate(grad_list):
+            if i != j:
+                neighbor_distances.append(np.linalg.norm(g_i-g_j)**2)
+        score.append(sum(np.sort(neighbor_distances)[0:len(grad_list)-s-2]))
+    return score.index(min(score))
+
+
+def _time(fn, repeat):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.time()
+        result = fn()
+        best = min(best, time.time()-start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Krum microbenchmark')
+    parser.add_argument('--workers', type=str, default='8,16,32,64', help='comma separated worker counts')
+    parser.add_argument('--dims', type=str, default='100000,1000000', help='comma separated gradient sizes')
+    parser.add_argument('--worker-fail', type=int, default=2, help='number of byzantine workers s')
+    parser.add_argument('--dtype', type=str, default='float32', help='dtype of the gradients')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per setting, the best one is reported')
+    parser.add_argument('--skip-loop-above', type=int, default=10**9, help='only time the Gram version when n*n*d is larger')
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    print("{:>4} {:>10} {:>12} {:>12} {:>9} {:>6}".format("n", "d", "loop (s)", "gram (s)", "speedup", "same"))
+    for d in [int(x) for x in args.dims.split(',')]:
+        for n in [int(x) for x in args.workers.split(',')]:
+            grads = rng.randn(n, d).astype(args.dtype)
+            # make a few workers byzantine so that there is a clear winner
+            grads[:args.worker_fail] *= -100
+            gram_time, selected = _time(lambda: krum_select([grads], args.worker_fail)[0], args.repeat)
+            if n*n*d > args.skip_loop_above:
+                print("{:>4} {:>10} {:>12} {:>12.4f} {:>9} {:>6}".format(n, d, "-", gram_time, "-", "-"))
+                continue
+            loop_time, legacy_selected = _time(lambda: _legacy_krum(list(grads), args.worker_fail), 1)
+            print("{:>4} {:>10} {:>12.4f} {:>12.4f} {:>9.1f} {:>6}".format(n, d, loop_time, gram_time,
+                loop_time/gram_time, str(legacy_selected == int(selected))))
+
+
+if __name__ == "__main__":
+    main()
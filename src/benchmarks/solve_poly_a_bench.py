@@ -0,0 +1,90 @@
+'''
+microbenchmark of the cyclic code error locator on master: the NumPy `coding.solve_poly_a` vs. the
+compiled `c_coding.solve_poly_a` (timed only when the extension is built). Received vectors are
+W x + e with `s` random adversaries in e, a trial counts as located when the `s` smallest values of
+the error-locator polynomial sit exactly on the adversaries
+
+    python benchmarks/solve_poly_a_bench.py --workers=8,16,32,64,128 --worker-fail=1,2,5
+'''
+from __future__ import print_function
+
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from coding import search_w, solve_poly_a
+
+try:
+    import c_coding
+except ImportError:
+    c_coding = None
+
+
+def _locate(n, s, alpha):
+    '''indices of the `s` workers the error-locator polynomial vanishes on (as in `CyclicMaster._decoding`)'''
+    z = np.exp(2*np.pi*np.arange(n)*1j/n)
+    poly_a = np.ones(s+1, dtype=complex)
+    poly_a[0:s] = -np.asarray(alpha).reshape(-1)
+    estimation = np.absolute(np.dot(np.power(z[:, None], np.arange(s+1)[None, :]), poly_a))
+    return set(np.argsort(estimation, kind='mergesort')[:s])
+
+
+def _time(fn, inputs, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.time()
+        for R in inputs:
+            fn(R)
+        best = min(best, (time.time()-start)/len(inputs))
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='cyclic error locator microbenchmark')
+    parser.add_argument('--workers', type=str, default='8,16,32,64,128', help='comma separated worker counts n')
+    parser.add_argument('--worker-fail', type=str, default='1,2,5', help='comma separated adversary counts s')
+    parser.add_argument('--trials', type=int, default=200, help='random received vectors per setting')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per setting, the best one is reported')
+    args = parser.parse_args()
+
+    if c_coding is None:
+        print("c_coding is not built, only timing the NumPy version")
+    rng = np.random.RandomState(0)
+    print("{:>4} {:>3} {:>12} {:>12} {:>9} {:>9} {:>10}".format(
+        "n", "s", "numpy (us)", "c (us)", "located", "c loc.", "max diff"))
+    for n in [int(x) for x in args.workers.split(',')]:
+        for s in [int(x) for x in args.worker_fail.split(',')]:
+            if n <= 2*s+1:
+                continue
+            W, _, _, _, _ = search_w(n, s)
+            inputs, adversaries = [], []
+            for _ in range(args.trials):
+                errors = np.zeros(n, dtype=complex)
+                adversary = rng.choice(n, size=s, replace=False)
+                errors[adversary] = -100*rng.rand(s)
+                inputs.append(np.dot(W, rng.normal(loc=1.0, size=n))+errors)
+                adversaries.append(set(adversary))
+            numpy_fn = lambda R: solve_poly_a(n=n, s=s, R=R)
+            numpy_time = _time(numpy_fn, inputs, args.repeat)
+            alphas = [numpy_fn(R) for R in inputs]
+            located = np.mean([_locate(n, s, a) == adv for a, adv in zip(alphas, adversaries)])
+            if c_coding is None:
+                print("{:>4} {:>3} {:>12.1f} {:>12} {:>9.3f} {:>9} {:>10}".format(
+                    n, s, 1e6*numpy_time, "-", located, "-", "-"))
+                continue
+            c_fn = lambda R: c_coding.solve_poly_a(n=n, s=s, R=R)
+            c_time = _time(c_fn, inputs, args.repeat)
+            c_alphas = [c_fn(R) for R in inputs]
+            c_located = np.mean([_locate(n, s, a) == adv for a, adv in zip(c_alphas, adversaries)])
+            max_diff = max(float(np.max(np.absolute(np.asarray(a).reshape(-1)-np.asarray(c).reshape(-1))))
+                            for a, c in zip(alphas, c_alphas))
+            print("{:>4} {:>3} {:>12.1f} {:>12.1f} {:>9.3f} {:>9.3f} {:>10.2e}".format(
+                n, s, 1e6*numpy_time, 1e6*c_time, located, c_located, max_diff))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import numpy as np
+from mpi4py import MPI
+
+# tags of bucketed gradient messages, bucket `b` is sent with tag `BUCKET_TAG_+b`
+BUCKET_TAG_ = 2000
+
+MPI_TYPES_ = {
+    np.dtype(np.float64): MPI.DOUBLE,
+    np.dtype(np.float32): MPI.FLOAT,
+    np.dtype(np.complex64): MPI.C_FLOAT_COMPLEX,
+    np.dtype(np.complex128): MPI.C_DOUBLE_COMPLEX,
+}
+
+class GradientBucket(object):
+    def __init__(self, shapes, dtype=np.float64, cap_mb=0, wire=None):
+        """
+        lay out the gradients of all layers of a model contiguously in one flat buffer,
+        the flat buffer is cut on layer boundaries into buckets of at most `cap_mb` MB
+        (`cap_mb=0` means the whole model goes into one bucket). Each bucket is one MPI
+        message, so a worker sends a handful of messages per step instead of one per layer.
+        With a `WireFormat` given, the buffer is laid out in its wire dtype instead of `dtype`
+        """
+        self.wire = wire
+        self.dtype = np.dtype(dtype) if wire is None else wire.dtype
+        self.mpi_type = MPI_TYPES_[self.dtype] if wire is None else wire.mpi_type
+        self.shapes = [tuple(s) for s in shapes]
+        self.sizes = [int(np.prod(s)) for s in self.shapes]
+        self.offsets = [int(o) for o in np.cumsum([0]+self.sizes[:-1])]
+        self.total_size = int(sum(self.sizes))
+        # (start, end) on the flat buffer and layer indices covered by each bucket
+        self.bucket_ranges = []
+        self.bucket_layers = []
+        cap = int(cap_mb*1024*1024/self.dtype.itemsize)
+        for layer_idx, size in enumerate(self.sizes):
+            start = self.offsets[layer_idx]
+            if len(self.bucket_ranges) == 0 or (cap > 0 and start+size-self.bucket_ranges[-1][0] > cap):
+                self.bucket_ranges.append((start, start+size))
+                self.bucket_layers.append([layer_idx])
+            else:
+                self.bucket_ranges[-1] = (self.bucket_ranges[-1][0], start+size)
+                self.bucket_layers[-1].append(layer_idx)
+        # preallocated send buffer, only used on workers
+        self.flat_buf = np.zeros(self.total_size, dtype=self.dtype)
+
+    @property
+    def num_buckets(self):
+        return len(self.bucket_ranges)
+
+    def layer_view(self, buf, layer_idx):
+        '''view of layer `layer_idx` inside a flat buffer (or a row of the master's gradient matrix)'''
+        start = self.offsets[layer_idx]
+        return buf[start:start+self.sizes[layer_idx]].reshape(self.shapes[layer_idx])
+
+    def pack(self, grads):
+        '''copy per-layer gradients (in model parameter order) into the flat send buffer'''
+        for layer_idx, grad in enumerate(grads):
+            if self.wire is None:
+                self.layer_view(self.flat_buf, layer_idx)[...] = grad
+            else:
+                self.wire.encode(grad, self.layer_view(self.flat_buf, layer_idx))
+        return self.flat_buf
+
+    def isend(self, comm, dest=0, persistent=False):
+        '''send all buckets, with `persistent=True` the (inactive) requests are only created, start them with `Startall`'''
+        send = comm.Send_init if persistent else comm.Isend
+        req_send_check = []
+        for b, (start, end) in enumerate(self.bucket_ranges):
+            req_send_check.append(send([self.flat_buf[start:end], self.mpi_type], dest=dest, tag=BUCKET_TAG_+b))
+        return req_send_check
+
+    def irecv(self, comm, buf, source, persistent=False):
+        '''post receives of all buckets from `source` straight into the flat buffer `buf`'''
+        recv = comm.Recv_init if persistent else comm.Irecv
+        req_recv_check = []
+        for b, (start, end) in enumerate(self.bucket_ranges):
+            req_recv_check.append(recv([buf[start:end], self.mpi_type], source=source, tag=BUCKET_TAG_+b))
+        return req_recv_check
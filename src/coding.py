@@ -1,11 +1,21 @@
+import os
 import numpy as np
-from scipy.optimize import lsq_linear
 
-def search_w(n, s):
+def search_w(n, s, cache_dir=None, real=False):
     # params: n: number of workers
     # params: s: number of fail workers
-    C = _construct_c(n)
-    C = np.dot(1/np.sqrt(n), C)
+    # params: cache_dir: if given, results are loaded from/saved to an `.npz` file keyed by (n, s) there
+    # params: real: real valued code built on the DCT-II matrix instead of the complex DFT one
+    if cache_dir:
+        cache_path = os.path.join(cache_dir, "cyclic_{}n{}_s{}.npz".format("real_" if real else "", n, s))
+        if os.path.isfile(cache_path):
+            cached = np.load(cache_path)
+            return cached['W'], cached['fake_W'], cached['W_perp'], cached['S'], cached['C_1']
+    if real:
+        C = _construct_dct(n)
+    else:
+        C = _construct_c(n)
+        C = np.dot(1/np.sqrt(n), C)
     _hat_s = int(2*s+1)
     W = _construct_w(n, _hat_s)
     C_1 = C[:, 0:n-_hat_s+1]
@@ -13,61 +23,129 @@ def search_w(n, s):
     W, fake_W = _cls_solving(C_1, W)
     W_perp = _array_getH(C_2)
     # prepare matrix S
-    s_tmp = np.zeros((1, n-_hat_s+1),dtype=complex)
-    s_tmp[0][0] = 1.0+0.0j
+    s_tmp = np.zeros((1, n-_hat_s+1),dtype=C_1.dtype)
+    s_tmp[0][0] = 1.0
     S = np.dot(s_tmp, _array_getH(C_1))
+    if cache_dir:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        # write then rename so that a concurrent reader never sees a partial file
+        tmp_path = cache_path+".tmp.{}.npz".format(os.getpid())
+        np.savez(tmp_path, W=W, fake_W=fake_W, W_perp=W_perp, S=S, C_1=C_1)
+        os.rename(tmp_path, cache_path)
     return W, fake_W, W_perp, S, C_1
 
 
 def _construct_c(n):
-    # complex matrix here
-    _shape = (n, n)
-    C = np.zeros(_shape, dtype=complex)
-    for p in range(_shape[0]):
-        for q in range(_shape[1]):
-            if q>=p:
-                if p == 0 or q == 0:
-                    C[p, q] = 1+0j
-                else:
-                    C[p, q]=0+np.exp(-2*np.pi*p*q*1j/n)
-            else:
-                C[p, q] = C[q, p]
+    # complex matrix here, the (unnormalized) DFT matrix C[p, q] = exp(-2*pi*i*p*q/n),
+    # p*q is reduced modulo n first to keep the phases accurate for large n
+    _k = np.arange(n)
+    return np.exp(-2j*np.pi*(np.outer(_k, _k) % n)/n)
+
+
+def chebyshev_nodes(n):
+    # x_i = cos(theta_i), theta_i = pi*(2i+1)/(2n), the roots of T_n, returns (x, theta)
+    theta = np.pi*(2*np.arange(n)+1)/(2.0*n)
+    return np.cos(theta), theta
+
+
+def _construct_dct(n):
+    # real matrix here, the orthonormal DCT-II matrix C[i, j] ~ cos(j*theta_i) = T_j(x_i),
+    # column j holds the Chebyshev polynomial T_j evaluated at the Chebyshev nodes
+    _, theta = chebyshev_nodes(n)
+    C = np.sqrt(2.0/n)*np.cos(np.outer(theta, np.arange(n)))
+    C[:, 0] = np.sqrt(1.0/n)
     return C
 
 
 def _construct_w(n, hat_s):
-    _shape=(n, n)
-    W = np.ones(_shape)
-    for i in range(_shape[0]):
-        if (i+hat_s) <= _shape[0]:
-            _valid_range = range(i,i+hat_s)
-        else:
-            _valid_range = range(i,n)
-            for t in range(i+hat_s-_shape[0]):
-                _valid_range.append(t)
-        for j in range(_shape[1]):
-            if j not in _valid_range:
-                W[i, j] = 0
-    return W
+    # support of the encoding matrix, row i covers the cyclic band of columns i, ..., i+hat_s-1 (mod n)
+    _k = np.arange(n)
+    return (((_k[None, :]-_k[:, None]) % n) < hat_s).astype(np.float64)
 
 
 def _cls_solving(C_1, fake_W):
     # return Q here:
+    # column i of W = C_1 Q has to vanish on the rows where fake_W[:, i] == 0, with Q[0, i] = 1
+    # that leaves C_1[zeros, 1:] q = -C_1[zeros, 0], one small square system per column,
+    # all of them are solved in one batched call
     _shape = np.transpose(C_1).shape
-    Q = np.ones(_shape,dtype=complex)
-    for i in range(_shape[1]):
-        indices = np.where(np.transpose(fake_W)[i]==0)[0]
-        _A = np.zeros((len(indices),C_1.shape[1]-1),dtype=complex)
-        _b = np.zeros((len(indices),1),dtype=complex)
-        for j, index in enumerate(indices):
-            _A[j] = C_1[index,1:]
-            _b[j] = -C_1[index,0]
-        _q=lsq_linear(_A, _b.reshape(-1)).x
-        Q[1:,i] = _q.reshape(Q[1:,i].shape)
+    n = fake_W.shape[1]
+    Q = np.ones(_shape,dtype=C_1.dtype)
+    _num_zeros = int(np.sum(fake_W[:, 0] == 0))
+    if _num_zeros > 0:
+        # row indices of the zeros of every column, shape (n, num_zeros)
+        indices = np.nonzero(np.transpose(fake_W) == 0)[1].reshape(n, _num_zeros)
+        _A = C_1[indices, 1:]
+        _b = -C_1[indices, 0]
+        if _A.shape[1] == _A.shape[2]:
+            _q = np.linalg.solve(_A, _b[..., None])[..., 0]
+        else:
+            _q = np.array([np.linalg.lstsq(_A[i], _b[i], rcond=None)[0] for i in range(n)])
+        Q[1:, :] = np.transpose(_q)
     W = np.dot(C_1, Q)
     return W, fake_W
 
 
+# W_perp of every (n, s) `solve_poly_a` was called with, it only depends on the code
+_w_perp_cache = {}
+
+def solve_poly_a(n, s, R):
+    '''
+    NumPy version of `c_coding.solve_poly_a`: coefficients alpha of the error-locator polynomial of
+    the cyclic code from the (n,) projected received vector `R`. The syndrome E_2 = W_perp R only
+    depends on the errors, it satisfies the linear recurrence
+    E_2[2s-1-i] = sum_j alpha_j E_2[s-1-i+j] for i = 0, ..., s-1, i.e. a s by s Toeplitz system
+    that is solved in the least squares sense (minimum norm when there are fewer than s errors)
+    returns alpha as a (s, 1) complex matrix, like the compiled extension
+    '''
+    if (n, s) not in _w_perp_cache:
+        _hat_s = int(2*s+1)
+        C_2 = np.dot(1/np.sqrt(n), _construct_c(n))[:, n-_hat_s+1:]
+        _w_perp_cache[(n, s)] = _array_getH(C_2)
+    E_2 = np.dot(_w_perp_cache[(n, s)], np.asarray(R).reshape(n))
+    _i = np.arange(s)
+    A = E_2[(s-1-_i)[:, None]+_i[None, :]]
+    b = E_2[2*s-1-_i]
+    alpha = np.linalg.lstsq(A, b, rcond=None)[0]
+    return alpha.reshape(s, 1)
+
+
+def solve_poly_a_real(n, s, R):
+    '''
+    error locator of the real valued code (`search_w(..., real=True)`), same contract as `solve_poly_a`.
+    Codewords are polynomials of degree < n-2s at the Chebyshev nodes x_i, and with the node
+    polynomial l(x) = prod(x-x_i) the vectors x_i^k/l'(x_i), k < 2s, are orthogonal to all of them
+    (l'(x_i) ~ (-1)^i/sin(theta_i)). So m_k = sum_i R_i x_i^k/l'(x_i) are moments of the errors
+    only, and P(x) = x^s - sum_j alpha_j x^j vanishing on the adversaries satisfies the s by s
+    Hankel system m_{k+s} = sum_j alpha_j m_{k+j}
+    returns alpha as a (s, 1) real matrix
+    '''
+    x, theta = chebyshev_nodes(n)
+    weights = np.power(-1.0, np.arange(n))*np.sin(theta)
+    m = np.dot(np.power(x[None, :], np.arange(2*s)[:, None])*weights[None, :], np.asarray(R).reshape(n))
+    _i = np.arange(s)
+    A = m[_i[:, None]+_i[None, :]]
+    b = m[s+_i]
+    alpha = np.linalg.lstsq(A, b, rcond=None)[0]
+    return alpha.reshape(s, 1)
+
+
+def recovery_vector(C_1, err_indices):
+    '''
+    (n,) vector v, zero outside the workers in `err_indices` (the ones not suspected of being adversaries),
+    with v C_1 = e_0 so that v W = 1 and v R is the sum of the gradients. It is the minimum norm
+    solution over all those workers rather than the square system of the first n-2s of them, which is
+    badly conditioned for the real code (|v| ~ 1e10 at n=32, s=5) and blows up float32 rounding errors
+    '''
+    A = np.transpose(C_1.take(err_indices, axis=0))
+    e_0 = np.zeros(A.shape[0], dtype=C_1.dtype)
+    e_0[0] = 1
+    v = np.zeros(C_1.shape[0], dtype=C_1.dtype)
+    v[err_indices] = np.linalg.lstsq(A, e_0, rcond=None)[0]
+    return v
+
+
 def _cls_solver(A, b):
     return np.dot(np.dot(np.linalg.inv(np.dot(_array_getH(A), A)), _array_getH(A)),b)
 
@@ -79,7 +157,7 @@ def _array_getH(ndarray):
 
 if __name__ == "__main__":
     np.set_printoptions(precision=4,linewidth=200.0)
-    W, fake_W, W_perp, S = search_w(7, 2)
+    W, fake_W, W_perp, S, C_1 = search_w(7, 2)
     print(np.dot(W_perp, W))
     print
-    print(S)
\ No newline at end of file
+    print(S)
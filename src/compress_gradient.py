@@ -1,15 +1,162 @@
+from __future__ import print_function
 import numpy as np
 import blosc
 
 import time
+from functools import partial
 from sys import getsizeof
 
+BLOSC_CODECS_ = ('blosclz', 'lz4', 'lz4hc', 'snappy', 'zlib', 'zstd')
+
+_SHUFFLES = {'none': blosc.NOSHUFFLE, 'byte': blosc.SHUFFLE, 'bit': blosc.BITSHUFFLE}
+
+class BloscCompressor(object):
+	def __init__(self, cname='snappy', clevel=9, shuffle='byte', typesize=0, nthreads=0):
+		'''
+		blosc codec `cname` with compression level `clevel` (0-9) and `shuffle` one of none/byte/bit,
+		`typesize=0` shuffles with the itemsize of the gradient (e.g. set it to 4 for complex64 payloads
+		so that real and imaginary parts are shuffled as float32), `nthreads=0` keeps blosc's default.
+		blosc's thread count is process wide, `use_compressor` sets it once instead of every `compress`
+		'''
+		assert cname in blosc.compressor_list(), "blosc was built without {}".format(cname)
+		self.cname = cname
+		self.clevel = clevel
+		self.shuffle = shuffle
+		self.typesize = typesize
+		self.nthreads = nthreads
+
+	def __repr__(self):
+		return "{}(clevel={}, shuffle={}, typesize={}, nthreads={})".format(self.cname, self.clevel, self.shuffle, self.typesize, self.nthreads)
+
+	def compress(self, grad):
+		grad = np.ascontiguousarray(grad)
+		typesize = self.typesize if self.typesize > 0 else grad.itemsize
+		assert grad.nbytes % typesize == 0
+		return blosc.compress_ptr(grad.__array_interface__['data'][0], grad.nbytes//typesize, typesize=typesize,
+									clevel=self.clevel, shuffle=_SHUFFLES[self.shuffle], cname=self.cname)
+
+class NoopCompressor(BloscCompressor):
+	def __init__(self, **kwargs):
+		'''plain memcpy into a blosc frame (level 0), master decompresses it like any other frame'''
+		kwargs.update(cname='blosclz', clevel=0, shuffle='none')
+		super(NoopCompressor, self).__init__(**kwargs)
+
+class CalibratedCompressor(object):
+	def __init__(self, target_mbps=1000.0, sample_mb=1.0, budget_mb=4.0, candidates=None, **kwargs):
+		'''
+		runs every candidate codec (all available blosc codecs with byte and bit shuffle) on the
+		first `budget_mb` MB of real gradients and measures compress ratio and MB/s. Gradients are
+		pooled into samples of at least `sample_mb` MB first, timing a codec on a few hundred bytes
+		(the bias of the last layer goes first) only measures per-call overhead. Until a codec is
+		picked gradients go out through the no-op. With a link of `target_mbps` MB/s, a codec meets
+		the target if compressing then sending is faster than sending raw gradients, i.e.
+		1/speed + 1/(ratio*target) <= 1/target. The fastest codec meeting the target is used from
+		then on, or the no-op when none does
+		'''
+		kwargs.pop('shuffle', None)
+		if candidates is None:
+			candidates = [BloscCompressor(cname=cname, shuffle=shuffle, **kwargs)
+							for cname in BLOSC_CODECS_ if cname in blosc.compressor_list() for shuffle in ('byte', 'bit')]
+		self.candidates = candidates
+		self.target_mbps = target_mbps
+		self.sample_bytes = int(sample_mb*1024*1024)
+		self.budget_bytes = int(budget_mb*1024*1024)
+		self._noop = NoopCompressor(**kwargs)
+		# gradients waiting to be pooled into the next sample
+		self._pending = []
+		self._pending_bytes = 0
+		self._raw_bytes = 0
+		self._compressed_bytes = [0]*len(candidates)
+		self._durations = [0.0]*len(candidates)
+		self.chosen = None
+
+	def compress(self, grad):
+		if self.chosen is not None:
+			return self.chosen.compress(grad)
+		grad = np.ascontiguousarray(grad)
+		self._pending.append(grad.reshape(-1))
+		self._pending_bytes += grad.nbytes
+		if self._pending_bytes >= self.sample_bytes:
+			self._measure(np.concatenate(self._pending))
+			self._pending = []
+			self._pending_bytes = 0
+		return self._noop.compress(grad)
+
+	def _measure(self, sample):
+		for c_idx, candidate in enumerate(self.candidates):
+			start = time.time()
+			frame = candidate.compress(sample)
+			self._durations[c_idx] += time.time() - start
+			self._compressed_bytes[c_idx] += len(frame)
+		self._raw_bytes += sample.nbytes
+		if self._raw_bytes >= self.budget_bytes:
+			self.chosen = self._choose()
+
+	def _choose(self):
+		best, best_speed = self._noop, 0.0
+		for c_idx, candidate in enumerate(self.candidates):
+			speed = self._raw_bytes/(1024.0*1024.0)/max(self._durations[c_idx], 1e-9)
+			ratio = self._raw_bytes/float(self._compressed_bytes[c_idx])
+			print("Compressor Calibration: {}, Ratio: {:.3f}, Speed: {:.1f} MB/s".format(candidate, ratio, speed))
+			if 1.0/speed + 1.0/(ratio*self.target_mbps) <= 1.0/self.target_mbps and speed > best_speed:
+				best, best_speed = candidate, speed
+		print("Compressor Calibration: picked {} for a {} MB/s target".format(best, self.target_mbps))
+		return best
+
+_COMPRESSORS = {}
+
+def register_compressor(name, factory):
+	'''`factory(**kwargs)` has to return an object with a `compress(grad)` method producing a blosc frame'''
+	_COMPRESSORS[name] = factory
+
+def get_compressor(name, **kwargs):
+	assert name in _COMPRESSORS, "unknown compressor {}, choose from {}".format(name, sorted(_COMPRESSORS.keys()))
+	return _COMPRESSORS[name](**kwargs)
+
+for _cname in BLOSC_CODECS_:
+	register_compressor(_cname, partial(BloscCompressor, _cname))
+register_compressor('none', NoopCompressor)
+register_compressor('auto', CalibratedCompressor)
+
+# compressor used by `compress`, replaced once per process with `use_compressor`
+_compressor = None
+
+def use_compressor(name, **kwargs):
+	'''select the compressor behind `compress` for this process and set blosc's threads for it'''
+	global _compressor
+	_compressor = get_compressor(name, **kwargs)
+	set_nthreads(kwargs.get('nthreads', 0))
+	return _compressor
+
+def set_nthreads(nthreads):
+	'''blosc threads of this process (compression on workers, decompression on master), `0` keeps blosc's default'''
+	if nthreads > 0:
+		blosc.set_nthreads(nthreads)
+
 def compress(grad):
+	'''
+	raw blosc frame of `grad`, sent as plain bytes with `Isend([frame, MPI.BYTE])`,
+	no pickling. dtype and shape are not part of the frame, the receiver already knows them
+	'''
+	global _compressor
 	assert isinstance(grad, np.ndarray)
-	compressed_grad = blosc.pack_array(grad, cname='snappy')
-	return compressed_grad
+	if _compressor is None:
+		_compressor = get_compressor('snappy')
+	return _compressor.compress(grad)
+
+def frame_capacity(nbytes):
+	'''size of a byte buffer that fits the blosc frame of any array of `nbytes` bytes'''
+	return nbytes + blosc.MAX_OVERHEAD
 
-def decompress(msg):
-	assert isinstance(msg, str)
-	grad = blosc.unpack_array(msg)
-	return grad
\ No newline at end of file
+def decompress(frame, out):
+	'''
+	decompress the blosc frame at the start of the uint8 receive buffer `frame` straight
+	into the preallocated array `out`, nothing is allocated for the gradient itself. Frames
+	describe their own codec and shuffle, so this works for every registered compressor
+	'''
+	# blosc header: uncompressed size at byte 4, compressed size at byte 12 (little endian)
+	nbytes = int(frame[4:8].view('<u4')[0])
+	cbytes = int(frame[12:16].view('<u4')[0])
+	assert nbytes == out.nbytes and out.flags['C_CONTIGUOUS']
+	blosc.decompress_ptr(frame[:cbytes], out.__array_interface__['data'][0])
+	return out
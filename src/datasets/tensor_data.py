@@ -0,0 +1,179 @@
+'''
+pre-tensorized training sets: the raw uint8 images are loaded once into one contiguous (N, C, H, W)
+array and minibatches are built with vectorized ops on the whole batch (gather, reflect padded random
+crop, horizontal flip, normalization) instead of a per-sample PIL transform chain
+'''
+import numpy as np
+from mpi4py import MPI
+
+import torch
+from torchvision import datasets
+
+# per channel mean and std on the [0, 1] scale, the same constants `util.load_data` normalizes with
+NORMALIZATION_ = {
+    "MNIST": ([0.1307], [0.3081]),
+    "Cifar10": ([x/255.0 for x in [125.3, 123.0, 113.9]], [x/255.0 for x in [63.0, 62.1, 66.7]]),
+}
+
+
+def _raw_arrays(dataset, train=True):
+    '''uint8 images as (N, C, H, W) and int64 labels of a torchvision MNIST/CIFAR10 dataset'''
+    images = getattr(dataset, 'data', None)
+    if images is None:
+        images = dataset.train_data if train else dataset.test_data
+    labels = getattr(dataset, 'targets', None)
+    if labels is None:
+        labels = dataset.train_labels if train else dataset.test_labels
+    if torch.is_tensor(images):
+        images = images.numpy()
+    if torch.is_tensor(labels):
+        labels = labels.numpy()
+    images = np.asarray(images, dtype=np.uint8)
+    if images.ndim == 3:
+        # MNIST, single channel
+        images = images[:, None, :, :]
+    else:
+        # CIFAR10 keeps HWC
+        images = images.transpose(0, 3, 1, 2)
+    return np.ascontiguousarray(images), np.asarray(labels, dtype=np.int64)
+
+
+class TensorDataset(object):
+    '''
+    whole training set in memory, `batch(indices, rng)` returns the (images, labels) tensors of a minibatch.
+    With `pad` > 0 every image is randomly cropped from its reflect padded version and flipped with
+    probability 1/2, as RandomCrop(size, padding) + RandomHorizontalFlip do per sample
+    '''
+    def __init__(self, images, labels, mean, std, pad=0, flip=False):
+        self.images = images
+        self.labels = labels
+        self.pad = pad
+        self.flip = flip
+        self._height, self._width = images.shape[2], images.shape[3]
+        # x/255 then (x-mean)/std folded into one scale and shift per channel
+        std = np.asarray(std, dtype=np.float32)
+        self._scale = (1.0/(255.0*std)).reshape(1, -1, 1, 1).astype(np.float32)
+        self._shift = (-np.asarray(mean, dtype=np.float32)/std).reshape(1, -1, 1, 1).astype(np.float32)
+        self._channels = np.arange(images.shape[1]).reshape(1, -1, 1, 1)
+
+    def __len__(self):
+        return self.images.shape[0]
+
+    def _reflect(self, coords, size):
+        # reflect padding index map, -1 -> 1 and size -> size-2
+        coords = np.abs(coords)
+        return np.where(coords >= size, 2*(size-1)-coords, coords)
+
+    def batch(self, indices, rng=None):
+        indices = np.asarray(indices)
+        if self.pad > 0 or self.flip:
+            if rng is None:
+                rng = np.random
+            num = indices.shape[0]
+            rows = np.tile(np.arange(self._height), (num, 1))
+            cols = np.tile(np.arange(self._width), (num, 1))
+            if self.pad > 0:
+                # crop offsets in [0, 2*pad] of the padded image, i.e. shifts in [-pad, pad]
+                rows = self._reflect(rows+rng.randint(0, 2*self.pad+1, size=(num, 1))-self.pad, self._height)
+                cols = self._reflect(cols+rng.randint(0, 2*self.pad+1, size=(num, 1))-self.pad, self._width)
+            if self.flip:
+                flipped = rng.rand(num) < 0.5
+                cols[flipped] = cols[flipped, ::-1]
+            # one gather does padding, crop and flip for the whole batch
+            images = self.images[indices.reshape(-1, 1, 1, 1), self._channels,
+                                 rows[:, None, :, None], cols[:, None, None, :]]
+        else:
+            images = self.images[indices]
+        images = images.astype(np.float32)
+        images *= self._scale
+        images += self._shift
+        return torch.from_numpy(images), torch.from_numpy(self.labels[indices])
+
+
+class TensorBatchLoader(object):
+    '''
+    iterates minibatches of a `TensorDataset`, shuffled with its own RandomState seeded with `seed`
+    (workers of the same majority vote group pass the same seed and see identical batches and
+    augmentations), or over the index lists of `batch_sampler`
+    '''
+    def __init__(self, dataset, batch_size=1, shuffle=False, batch_sampler=None, seed=None):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.batch_sampler = batch_sampler
+        self.rng = np.random.RandomState(seed)
+
+    def __len__(self):
+        if self.batch_sampler is not None:
+            return len(self.batch_sampler)
+        return (len(self.dataset)+self.batch_size-1)//self.batch_size
+
+    def __iter__(self):
+        if self.batch_sampler is not None:
+            for indices in self.batch_sampler:
+                yield self.dataset.batch(indices, self.rng)
+            return
+        if self.shuffle:
+            order = self.rng.permutation(len(self.dataset))
+        else:
+            order = np.arange(len(self.dataset))
+        for start in range(0, len(order), self.batch_size):
+            yield self.dataset.batch(order[start:start+self.batch_size], self.rng)
+
+
+def _load_raw(dataset, root, train, download):
+    if dataset == "MNIST":
+        raw = datasets.MNIST(root, train=train, download=download)
+    elif dataset == "Cifar10":
+        raw = datasets.CIFAR10(root=root, train=train, download=download)
+    return _raw_arrays(raw, train=train)
+
+
+def _share_on_node(load, comm):
+    '''
+    (images, labels) produced by `load()` on one rank per node and mapped by the other ranks of the node
+    from an MPI shared memory window, without a copy. Returns the arrays and the window, which has to
+    stay alive as long as they are used
+    '''
+    node_comm = comm.Split_type(MPI.COMM_TYPE_SHARED)
+    leader = node_comm.Get_rank() == 0
+    images, labels = load() if leader else (None, None)
+    shapes = node_comm.bcast((images.shape, labels.shape) if leader else None, root=0)
+    # labels (int64) first so that both arrays are aligned within the window
+    labels_nbytes = int(np.prod(shapes[1]))*8
+    nbytes = labels_nbytes+int(np.prod(shapes[0]))
+    window = MPI.Win.Allocate_shared(nbytes if leader else 0, 1, comm=node_comm)
+    buf, _ = window.Shared_query(0)
+    shared = np.ndarray(buffer=buf, dtype=np.uint8, shape=(nbytes,))
+    shared_labels = shared[:labels_nbytes].view(np.int64).reshape(shapes[1])
+    shared_images = shared[labels_nbytes:].reshape(shapes[0])
+    if leader:
+        shared_labels[...] = labels
+        shared_images[...] = images
+    node_comm.Barrier()
+    return shared_images, shared_labels, window
+
+
+def load_tensor_dataset(dataset, root, train=True, augment=True, download=True, comm=None):
+    '''
+    `TensorDataset` of MNIST (no augmentation) or Cifar10 (pad 4, random crop and flip when `augment`).
+    With `comm`, rank 0 downloads first and then a single rank per node reads the files into node-wide
+    shared memory that the other ranks of the node attach to (all ranks of `comm` have to call this)
+    '''
+    if comm is None:
+        images, labels = _load_raw(dataset, root, train, download)
+        window = None
+    else:
+        preloaded = None
+        if download and comm.Get_rank() == 0:
+            # no racing downloads, rank 0 (the first rank of its node) then shares what it loaded
+            preloaded = _load_raw(dataset, root, train, download)
+        comm.Barrier()
+        load = lambda: preloaded if preloaded is not None else _load_raw(dataset, root, train, download)
+        images, labels, window = _share_on_node(load, comm)
+    mean, std = NORMALIZATION_[dataset]
+    pad, flip = (4, True) if (dataset == "Cifar10" and augment) else (0, False)
+    tensor_set = TensorDataset(images, labels, mean, std, pad=pad, flip=flip)
+    # keeps the shared memory mapped for as long as the dataset lives
+    tensor_set.window = window
+    return tensor_set
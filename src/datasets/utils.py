@@ -4,6 +4,8 @@ from torch.utils import data
 import torch
 from torchvision import datasets, transforms
 
+from datasets.tensor_data import TensorDataset, TensorBatchLoader
+
 class DynamicSampler(object):
     def __init__(self, max_size=100):
         self.next_batch = [0]
@@ -28,6 +30,43 @@ def get_batch(dataset, indices=None):
 
     return iter(loader).next()
 
+class CyclicBatchSampler(object):
+    '''
+    batch sampler of a cyclic coded worker: step j covers the global batch of samples
+    [j*batch_size*num_workers, (j+1)*batch_size*num_workers), of which the worker only needs the
+    local batches `local_batch_indices`, they are yielded as one concatenated index list per step.
+    The steps of `num_epochs` epochs are yielded back to back, so a single iterator covers the whole run
+    '''
+    def __init__(self, dataset_size, batch_size, num_workers, local_batch_indices, num_epochs=1):
+        self.global_batch_size = batch_size*num_workers
+        # a global batch has to end before the last sample, as in the original loop over `get_batch`
+        self.num_steps = max((dataset_size-1)//self.global_batch_size, 0)
+        self.num_epochs = num_epochs
+        self.offsets = np.concatenate([np.arange(k*batch_size, (k+1)*batch_size) for k in local_batch_indices])
+
+    def __iter__(self):
+        for _ in range(self.num_epochs):
+            for step in range(self.num_steps):
+                yield (step*self.global_batch_size+self.offsets).tolist()
+
+    def __len__(self):
+        return self.num_steps*self.num_epochs
+
+def cyclic_batch_loader(dataset, batch_size, num_workers, local_batch_indices, loader_workers=0, seed=None, num_epochs=1):
+    '''
+    loader yielding the concatenated local batches of a cyclic coded worker for every step of
+    `num_epochs` epochs, only those samples are loaded and transformed. Iterate it once for the whole
+    run: every new iterator of a `DataLoader` forks its `loader_workers` processes again. With
+    `loader_workers` > 0 the next steps are prefetched by background processes while the current one
+    is computed (forking an MPI process is not supported by every MPI transport, hence opt-in).
+    A `TensorDataset` builds every step's batch with vectorized ops in the training process instead,
+    augmented with `seed`
+    '''
+    sampler = CyclicBatchSampler(len(dataset), batch_size, num_workers, local_batch_indices, num_epochs=num_epochs)
+    if isinstance(dataset, TensorDataset):
+        return TensorBatchLoader(dataset, batch_sampler=sampler, seed=seed)
+    return data.DataLoader(dataset, batch_sampler=sampler, num_workers=loader_workers)
+
 if __name__ == '__main__':
     train_dataset = datasets.MNIST('./mnist_data', train=True, download=True,
                transform=transforms.Compose([
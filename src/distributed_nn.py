@@ -16,7 +16,6 @@ import torch.nn.functional as F
 from nn_ops import NN_Trainer, accuracy
 from data_loader_ops.my_data_loader import DataLoader
 
-from coding import search_w
 from util import *
 
 
@@ -47,12 +46,12 @@ def add_fit_args(parser):
     parser.add_argument('--network', type=str, default='LeNet', metavar='N',
                         help='which kind of network we are going to use, support LeNet and ResNet currently')
     parser.add_argument('--mode', type=str, default='normal', metavar='N',
-                        help='determine if we use normal averaged gradients or geometric median (in normal mode)\
-                         or whether we use normal/majority vote in coded mode to udpate the model')
+                        help='determine if we use normal averaged gradients, geometric median, krum, coord_median or trimmed_mean\
+                         (in normal mode) or whether we use normal/majority vote in coded mode to udpate the model')
     parser.add_argument('--dataset', type=str, default='MNIST', metavar='N',
                         help='which dataset used in training, MNIST and Cifar10 supported currently')
     parser.add_argument('--comm-type', type=str, default='Bcast', metavar='N',
-                        help='which kind of method we use during the mode fetching stage')
+                        help='which kind of method we use during the mode fetching stage: Bcast/Async (per layer) or Packet (step and weights in one Ibcast)')
     parser.add_argument('--err-mode', type=str, default='rev_grad', metavar='N',
                         help='which type of byzantine err we are going to simulate rev_grad/constant/random are supported')
     parser.add_argument('--approach', type=str, default='maj_vote', metavar='N',
@@ -73,6 +72,64 @@ def add_fit_args(parser):
                         help='compress/none indicate if we compress the gradient matrix before communication')
     parser.add_argument('--checkpoint-step', type=int, default=0, metavar='N',
                         help='which step to proceed the training process')  
+    parser.add_argument('--bucket-grad', action='store_true', default=False,
+                        help='pack all gradients of a worker into flat buckets, one MPI message per bucket instead of one per layer')
+    parser.add_argument('--bucket-cap-mb', type=float, default=0, metavar='N',
+                        help='size cap of a gradient bucket in MB, 0 means the whole model goes into a single bucket')
+    parser.add_argument('--persistent-comm', action='store_true', default=False,
+                        help='bind the per-step gradient and weight exchange to persistent MPI requests (uncompressed or bucketed gradients only)')
+    parser.add_argument('--wire-dtype', type=str, default='float64', metavar='N',
+                        help='dtype weights and gradients travel in: float64, float32, float16 or bfloat16')
+    parser.add_argument('--compressor', type=str, default='snappy', metavar='N',
+                        help='gradient codec when compress-grad=compress: blosclz, lz4, lz4hc, snappy, zlib, zstd, none or auto (calibrated)')
+    parser.add_argument('--compress-level', type=int, default=9, metavar='N',
+                        help='blosc compression level (0-9)')
+    parser.add_argument('--compress-shuffle', type=str, default='byte', metavar='N',
+                        help='blosc shuffle filter: none, byte or bit')
+    parser.add_argument('--compress-typesize', type=int, default=0, metavar='N',
+                        help='blosc shuffle typesize in bytes, 0 means the itemsize of the gradient')
+    parser.add_argument('--compress-threads', type=int, default=0, metavar='N',
+                        help='blosc threads for compression on workers and decompression on master, 0 keeps the blosc default')
+    parser.add_argument('--compress-target-mbps', type=float, default=1000.0, metavar='N',
+                        help='link bandwidth in MB/s the `auto` compressor calibrates against')
+    parser.add_argument('--aggregate-scope', type=str, default='layer', metavar='N',
+                        help='layer/model: run robust aggregation (e.g. krum) or cyclic decoding on every layer separately or on the whole model')
+    parser.add_argument('--multi-krum-m', type=int, default=1, metavar='N',
+                        help='average the m workers with the best Krum scores, 1 means plain Krum')
+    parser.add_argument('--geo-median-tol', type=float, default=1e-6, metavar='N',
+                        help='relative tolerance the Weiszfeld geometric median stops at')
+    parser.add_argument('--geo-median-max-iter', type=int, default=200, metavar='N',
+                        help='maximum number of Weiszfeld iterations per geometric median')
+    parser.add_argument('--trim-beta', type=float, default=0.1, metavar='N',
+                        help='fraction of workers dropped from each side of every coordinate in trimmed_mean mode')
+    parser.add_argument('--aggregate-chunk-size', type=int, default=65536, metavar='N',
+                        help='number of coordinates processed at once by coord_median/trimmed_mean')
+    parser.add_argument('--aggregate-threads', type=int, default=0, metavar='N',
+                        help='threads coord_median/trimmed_mean spread the coordinate chunks over, 0 means all cores')
+    parser.add_argument('--coding-cache-dir', type=str, default='coding_cache/', metavar='N',
+                        help='directory the cyclic coding matrices are cached in, keyed by (number of workers, worker-fail), empty disables the cache')
+    parser.add_argument('--syndrome-tol', type=float, default=1e-4, metavar='N',
+                        help='cyclic decoding skips the error locator when |W_perp R| <= syndrome-tol*|R| for the projected received gradients')
+    parser.add_argument('--recover-cache-size', type=int, default=64, metavar='N',
+                        help='number of adversary patterns whose cyclic recovery vectors are kept in an LRU cache, 0 disables it')
+    parser.add_argument('--real-code', action='store_true', default=False,
+                        help='use the real valued (DCT) cyclic code, coded gradients are sent and decoded as float32 instead of complex')
+    parser.add_argument('--encode-mode', type=str, default='per_batch', metavar='N',
+                        help='per_batch/weighted_loss: cyclic workers backward every local batch and encode, or backward the coded loss of all batches at once')
+    parser.add_argument('--loader-workers', type=int, default=0, metavar='N',
+                        help='processes loading and prefetching the local batches of cyclic workers, 0 (default) loads in the training process')
+    parser.add_argument('--data-backend', type=str, default='torchvision', metavar='N',
+                        help='torchvision/tensor: per sample transforms, or raw images in memory with batch level augmentation')
+    parser.add_argument('--shared-dataset', action='store_true', default=False,
+                        help='with data-backend=tensor, load the training set once per node into MPI shared memory that all ranks of the node map')
+    parser.add_argument('--wait-policy', type=str, default='block', metavar='N',
+                        help='block/backoff/thread: how workers wait for the next step, blocking receive, sleep-backoff polling or a comm thread')
+    parser.add_argument('--wait-max-sleep', type=float, default=5e-3, metavar='N',
+                        help='longest sleep in seconds between two polls of the backoff and thread wait policies')
+    parser.add_argument('--zero-copy-model', action='store_true', default=False,
+                        help='with comm-type=Packet and wire-dtype=float32, worker parameters are views of the received packet so a model update copies nothing')
+    parser.add_argument('--stream-grad', action='store_true', default=False,
+                        help='with bucket-grad, baseline workers send gradient buckets from autograd hooks while backward still runs (any network)')
     args = parser.parse_args()
     return args
 
@@ -115,9 +172,6 @@ if __name__ == "__main__":
             print("Now the next step is: {}".format(coded_worker.next_step))
     # cyclic code
     elif args.approach == "cyclic":
-        W, fake_W, W_perp, S, C_1 = search_w(world_size-1, args.worker_fail)
-        # for debug print
-        #np.set_printoptions(precision=4,linewidth=200.0)
         _, training_set, test_loader = datum
         if rank == 0:
             cyclic_master = cyclic_master.CyclicMaster(comm=comm, **kwargs_master)
@@ -26,6 +26,30 @@ class SyncReplicasMaster_NN(NN_Trainer):
         self._compress_grad = kwargs['compress_grad']
         self._checkpoint_step = kwargs['checkpoint_step']
         self._s = kwargs['worker_fail']
+        self._bucket_grad = kwargs['bucket_grad']
+        self._bucket_cap_mb = kwargs['bucket_cap_mb']
+        # persistent requests need raw (uncompressed or bucketed) receive buffers
+        self._persistent_comm = kwargs['persistent_comm'] and (self._compress_grad == 'None' or self._bucket_grad)
+        self._fetch_requests = None
+        self._weight_requests = None
+        # dtype weights and gradients travel in, weights are encoded into `_weight_send_buf` once per step
+        self._wire = WireFormat(kwargs['wire_dtype'])
+        self._weight_send_buf = None
+        # step and weights in one message with comm-type Packet, allocated on first use
+        self._model_packet = None
+        self._compress_threads = kwargs['compress_threads']
+        # robust aggregation over each layer separately or over the whole model at once
+        self._aggregate_scope = kwargs['aggregate_scope']
+        self._multi_krum_m = kwargs['multi_krum_m']
+        self._geo_median_tol = kwargs['geo_median_tol']
+        self._geo_median_max_iter = kwargs['geo_median_max_iter']
+        # last step's geometric median (one vector per layer), warm starts the next solve
+        self._geo_median_prev = None
+        # coordinate-wise rules run over column chunks of the stacked gradients on a thread pool
+        self._trim_beta = kwargs['trim_beta']
+        self._aggregate_chunk_size = kwargs['aggregate_chunk_size']
+        self._aggregate_threads = kwargs['aggregate_threads']
+        self._aggregate_pool = None
 
     def build_model(self):
         # build network
@@ -57,10 +81,25 @@ class SyncReplicasMaster_NN(NN_Trainer):
             self.cur_step = int(self._checkpoint_step)+1
 
         # assign a gradient accumulator to collect gradients from workers
-        self.grad_accumulator = GradientAccumulator(self.network, self.world_size-1, mode=self._compress_grad)
+        self.init_bucket()
+        self.grad_accumulator = GradientAccumulator(self.network, self.world_size-1, mode=self._compress_grad, bucket=self._bucket, persistent=self._persistent_comm, wire=self._wire)
+        self.init_gatherer()
         self.init_model_shapes()
         self.optimizer = SGDModified(self.network.parameters(), lr=self.lr, momentum=self.momentum)
 
+    def init_bucket(self, dtype=None):
+        '''layout of the flat gradient buckets, workers build exactly the same one (in the wire dtype unless `dtype` is given)'''
+        self._bucket = None
+        if self._bucket_grad:
+            wire = self._wire if dtype is None else None
+            self._bucket = GradientBucket([p.size() for p in self.network.parameters()], dtype=dtype, cap_mb=self._bucket_cap_mb, wire=wire)
+
+    def init_gatherer(self):
+        self.gatherer = GradientGatherer(self.grad_accumulator, self._num_grad_to_collect, compressed=self.grad_accumulator.compressed)
+        if self.grad_accumulator.compressed:
+            # frames describe their own codec, only the decompression threads are set on master
+            set_nthreads(self._compress_threads)
+
     def start(self):
         # the first step we need to do here is to sync fetch the inital worl_step from the parameter server
         # we still need to make sure the value we fetched from parameter server is 1
@@ -71,12 +110,14 @@ class SyncReplicasMaster_NN(NN_Trainer):
         for i in range(1, self._max_steps+1):
             # switch back to training mode
             self.network.train()
-            self._first_grad_received = False
-            enough_gradients_received = False
 
             print("Master node is entering step: {}".format(i))
 
-            self.async_bcast_step()
+            packet_request = None
+            if self.comm_type == "Packet":
+                packet_request = self.bcast_model_packet()
+            else:
+                self.async_bcast_step()
 
             if self.comm_type == "Bcast":
                 self.async_bcast_layer_weights_bcast()
@@ -85,35 +126,12 @@ class SyncReplicasMaster_NN(NN_Trainer):
             
             # set the gradient fetch step and gather the request
             gradient_fetch_requests=self.async_fetch_gradient_start()
+            if packet_request is not None:
+                # gradient receives are already posted while the packet is on its way
+                packet_request.Wait()
 
             # wait for enough gradients to be aggregated:
-            while not enough_gradients_received:
-                status = MPI.Status()
-                if self._compress_grad == "None":
-                    MPI.Request.Waitany(requests=gradient_fetch_requests, status=status)
-                elif self._compress_grad == "compress":
-                    _, received_msg=MPI.Request.waitany(requests=gradient_fetch_requests, status=status)
-                    received_grad=decompress(received_msg)
-
-                if status.tag-88 in self.grad_accumulator.model_index_range:
-                    if not self._first_grad_received:
-                        self._first_grad_received=True
-                        grad_gather_start_time = time.time()
-
-                    layer_index = status.tag-88
-                    if self._compress_grad == "None":
-                        received_grad=self.grad_accumulator.gradient_aggregator[layer_index][status.source-1]
-                    # do gradient shape check here
-                    assert (received_grad.shape == self._model_shapes[layer_index])
-
-                    # aggregate the gradient
-                    if self.grad_accumulator.gradient_aggregate_counter[layer_index] <= self._num_grad_to_collect:
-                        self.aggregate_gradient(gradient=received_grad, layer_idx=layer_index)
-                    self.grad_accumulator.gradient_aggregate_counter[layer_index] += 1
-                
-                enough_gradients_received = True
-                for j in self.grad_accumulator.gradient_aggregate_counter:
-                    enough_gradients_received = enough_gradients_received and (j >= self._num_grad_to_collect)
+            gather_duration = self.gatherer.gather(gradient_fetch_requests, self._fetch_request_layers, self._handle_gradient)
 
             if self._update_mode == "normal":
                 method_start = time.time()
@@ -127,6 +145,10 @@ class SyncReplicasMaster_NN(NN_Trainer):
                 method_start = time.time()
                 self._krum()
                 method_duration = time.time()-method_start
+            elif self._update_mode in ("coord_median", "trimmed_mean"):
+                method_start = time.time()
+                self._coordinate_wise()
+                method_duration = time.time()-method_start
 
             # update using SGD method
             update_start = time.time()
@@ -142,15 +164,15 @@ class SyncReplicasMaster_NN(NN_Trainer):
             if self.cur_step%self._eval_freq == 0:
                 if "ResNet" not in self.network_config:
                     self._save_model(file_path=self._generate_model_path())
-            print("Master Step: {}, Method Time Cost: {}, Update Time Cost: {}".format(self.cur_step, method_duration, update_duration))
+            print("Master Step: {}, Gather Time Cost: {}, Method Time Cost: {}, Update Time Cost: {}".format(self.cur_step, gather_duration, method_duration, update_duration))
             self.cur_step += 1
 
     def init_model_shapes(self):
         for param_idx, param in enumerate(self.network.parameters()):
             self._model_shapes.append(param.size())
             if self._update_mode == "normal":
-                self._grad_aggregate_buffer.append(np.zeros(param.size()))
-            elif self._update_mode in ("geometric_median", "krum"):
+                self._grad_aggregate_buffer.append(np.zeros(param.size(), dtype=self._wire.compute_dtype))
+            elif self._update_mode in ("geometric_median", "krum", "coord_median", "trimmed_mean"):
                 self._grad_aggregate_buffer.append([])
 
     def async_bcast_step(self):
@@ -161,14 +183,26 @@ class SyncReplicasMaster_NN(NN_Trainer):
         for i in range(len(req_list)):
             req_list[i].wait()
 
+    def bcast_model_packet(self):
+        '''post one nonblocking broadcast of the current step and weights, returns its request'''
+        if self._model_packet is None:
+            self._model_packet = ModelPacket([layer.size() for layer in self.network.parameters()], self._wire)
+        # one update per step, the version counts the updates the weights have seen
+        self._model_packet.pack(self.cur_step, self.cur_step-STEP_START_, [layer.data.numpy() for layer in self.network.parameters()])
+        return self._model_packet.ibcast(self.comm)
+
     def async_bcast_layer_weights_async(self):
+        if self._persistent_comm:
+            self._persistent_bcast_weights(comm_type="Async")
+            return
         request_layers = []
+        weight_send_buf = self._encode_weights()
         for layer_idx, layer in enumerate(self.network.parameters()):
             request_workers = []
-            layer_to_send = layer.data.numpy().astype(np.float64)
+            layer_to_send = weight_send_buf[layer_idx]
             for i in range(self.world_size):
                 if i != 0:
-                    req = self.comm.Isend([layer_to_send, MPI.DOUBLE], dest=i, tag=11+layer_idx)
+                    req = self.comm.Isend([layer_to_send, self._wire.mpi_type], dest=i, tag=11+layer_idx)
                     request_workers.append(req)
 
             request_layers.append(request_workers)
@@ -178,34 +212,93 @@ class SyncReplicasMaster_NN(NN_Trainer):
                 req_worker.wait()
 
     def async_bcast_layer_weights_bcast(self):
+        if self._persistent_comm:
+            self._persistent_bcast_weights(comm_type="Bcast")
+            return
         request_layers = []
+        weight_send_buf = self._encode_weights()
         for layer_idx, layer in enumerate(self.network.parameters()):
             request_workers = []
-            layer_to_send = layer.data.numpy().astype(np.float64)
+            layer_to_send = weight_send_buf[layer_idx]
             # try to see if collective communication is better here:
-            self.comm.Bcast([layer_to_send, MPI.DOUBLE], root=0)
+            self.comm.Bcast([layer_to_send, self._wire.mpi_type], root=0)
+
+    def _encode_weights(self):
+        '''encode the current weights into the preallocated wire buffers, allocated on first use'''
+        if self._weight_send_buf is None:
+            self._weight_send_buf = [np.zeros(layer.size(), dtype=self._wire.dtype) for layer in self.network.parameters()]
+        for buf, layer in zip(self._weight_send_buf, self.network.parameters()):
+            self._wire.encode(layer.data.numpy(), buf)
+        return self._weight_send_buf
+
+    def _persistent_bcast_weights(self, comm_type):
+        '''
+        weights are copied into preallocated send buffers that are bound once to persistent
+        sends (or to persistent broadcasts where MPI-4 is available)
+        '''
+        weight_send_buf = self._encode_weights()
+        if self._weight_requests is None:
+            self._weight_requests = []
+            for layer_idx, buf in enumerate(weight_send_buf):
+                if comm_type == "Bcast" and persistent_bcast_supported():
+                    self._weight_requests.append(self.comm.Bcast_init([buf, self._wire.mpi_type], root=0))
+                elif comm_type == "Async":
+                    for i in range(1, self.world_size):
+                        self._weight_requests.append(self.comm.Send_init([buf, self._wire.mpi_type], dest=i, tag=11+layer_idx))
+        if len(self._weight_requests) == 0:
+            for buf in weight_send_buf:
+                self.comm.Bcast([buf, self._wire.mpi_type], root=0)
+            return
+        MPI.Prequest.Startall(self._weight_requests)
+        MPI.Request.Waitall(self._weight_requests)
 
     def async_fetch_gradient_start(self):
         '''
         make gradient fetch requests and return the request list
         '''
+        if self._persistent_comm:
+            # receives are bound to the accumulator buffers once and only restarted every step
+            if self._fetch_requests is None:
+                self._fetch_requests = self._make_gradient_fetch_requests(persistent=True)
+            MPI.Prequest.Startall(self._fetch_requests)
+            return self._fetch_requests
+        return self._make_gradient_fetch_requests()
+
+    def _make_gradient_fetch_requests(self, persistent=False):
         gradient_fetch_requests = [] # `graident_fetch_request` should have length of #fc_layer*num_grad_to_collect
+        # (source, layer indices) carried by each request, used by the gatherer
+        self._fetch_request_layers = []
+        if self._bucket_grad:
+            # one request per bucket per worker, received straight into the worker's row
+            for k in range(self._num_grad_to_collect):
+                gradient_fetch_requests.extend(self._bucket.irecv(self.comm, self.grad_accumulator.gradient_matrix[k], source=k+1, persistent=persistent))
+                self._fetch_request_layers.extend([(k+1, layers) for layers in self._bucket.bucket_layers])
+            return gradient_fetch_requests
         for layer_idx, layer in enumerate(self.network.parameters()):
             for k in range(self._num_grad_to_collect):
                 if self._compress_grad == 'compress':
-                    req = self.comm.irecv(self.grad_accumulator.gradient_aggregator[layer_idx][k], source=k+1, tag=88+layer_idx)
+                    # raw blosc frame, decompressed by the gatherer once it arrives
+                    req = self.comm.Irecv([self.grad_accumulator.compressed_aggregator[layer_idx][k], MPI.BYTE], source=k+1, tag=88+layer_idx)
+                elif persistent:
+                    req = self.comm.Recv_init([self.grad_accumulator.gradient_aggregator[layer_idx][k], self.grad_accumulator.mpi_type], source=k+1, tag=88+layer_idx)
                 else:
-                    req = self.comm.Irecv([self.grad_accumulator.gradient_aggregator[layer_idx][k], MPI.DOUBLE], source=k+1, tag=88+layer_idx)
+                    req = self.comm.Irecv([self.grad_accumulator.gradient_aggregator[layer_idx][k], self.grad_accumulator.mpi_type], source=k+1, tag=88+layer_idx)
                 gradient_fetch_requests.append(req)
+                self._fetch_request_layers.append((k+1, [layer_idx]))
         return gradient_fetch_requests
 
+    def _handle_gradient(self, layer_index, source, received_grad):
+        # do gradient shape check here
+        assert (received_grad.shape == self._model_shapes[layer_index])
+        self.aggregate_gradient(gradient=received_grad, layer_idx=layer_index)
+
     def aggregate_gradient(self, gradient, layer_idx):
         '''
         keep in mind the gradient here is wrapped gradient, which means it contains `W` and `b`
         '''
         if self._update_mode == "normal":
             self._grad_aggregate_buffer[layer_idx] += gradient
-        elif self._update_mode in ("geometric_median", "krum"):
+        elif self._update_mode in ("geometric_median", "krum", "coord_median", "trimmed_mean"):
             _shape = gradient.shape
             if len(_shape)==1:
                 self._grad_aggregate_buffer[layer_idx].append(gradient)             
@@ -230,8 +323,8 @@ class SyncReplicasMaster_NN(NN_Trainer):
     def meset_grad_buffer(self):
         for i in range(len(self._grad_aggregate_buffer)):
             if self._update_mode == "normal" or self._update_mode == "maj_vote":
-                self._grad_aggregate_buffer[i] = np.zeros(self._grad_aggregate_buffer[i].shape)
-            elif self._update_mode in ("geometric_median", "krum"):
+                self._grad_aggregate_buffer[i] = np.zeros(self._grad_aggregate_buffer[i].shape, dtype=self._grad_aggregate_buffer[i].dtype)
+            elif self._update_mode in ("geometric_median", "krum", "coord_median", "trimmed_mean"):
                 self._grad_aggregate_buffer[i] = []
 
     def _generate_model_path(self):
@@ -269,28 +362,60 @@ class SyncReplicasMaster_NN(NN_Trainer):
             self._grad_aggregate_buffer[i] /= self._num_grad_to_collect
 
     def _get_geo_median(self):
+        '''
+        Weiszfeld geometric median of the stacked gradients, per layer or, with `aggregate_scope=model`,
+        over the whole model, warm started from the previous step's median
+        '''
         geo_median_start = time.time()
-        for g_idx, grads in enumerate(self._grad_aggregate_buffer):
-            geo_median = np.array(hd.geomedian(np.array(grads), axis=0))
+        stacked_grads = [self._stacked_grads(g_idx) for g_idx in range(len(self._grad_aggregate_buffer))]
+        if self._aggregate_scope == "model":
+            geo_medians, iterations = weiszfeld(stacked_grads, init=self._geo_median_prev,
+                                        tol=self._geo_median_tol, max_iter=self._geo_median_max_iter)
+        else:
+            geo_medians, iterations = [], 0
+            for g_idx, grads in enumerate(stacked_grads):
+                init = None if self._geo_median_prev is None else [self._geo_median_prev[g_idx]]
+                layer_median, layer_iterations = weiszfeld([grads], init=init,
+                                        tol=self._geo_median_tol, max_iter=self._geo_median_max_iter)
+                geo_medians.append(layer_median[0])
+                iterations += layer_iterations
+        for g_idx, geo_median in enumerate(geo_medians):
             self._grad_aggregate_buffer[g_idx] = geo_median
-        print("Master Step: {} Found Geo Median Cost: {:.4f}".format(self.cur_step, time.time()-geo_median_start))
+        self._geo_median_prev = geo_medians
+        print("Master Step: {} Found Geo Median Cost: {:.4f}, Iterations: {}".format(self.cur_step, time.time()-geo_median_start, iterations))
+
+    def _stacked_grads(self, layer_idx):
+        '''(num_workers, layer size) matrix of the received gradients of a layer, a view when gradients are bucketed'''
+        stacked = self.grad_accumulator.layer_matrix(layer_idx)
+        if stacked is None:
+            stacked = np.array(self._grad_aggregate_buffer[layer_idx])
+        return stacked
 
     def _krum(self):
-        def __krum(grad_list, s):
-            '''
-            Method introduced by: https://arxiv.org/abs/1703.02757
-            '''
-            score = []
-            for i, g_i in enumerate(grad_list):
-                neighbor_distances = []
-                for j, g_j in enumerate(grad_list):
-                    if i != j:
-                        neighbor_distances.append(np.linalg.norm(g_i-g_j)**2)
-                score.append(sum(np.sort(neighbor_distances)[0:self.num_workers-s-2]))
-            i_star = score.index(min(score))
-            return grad_list[i_star]
+        '''
+        Krum (Multi-Krum with `multi_krum_m` > 1) on Gram matrices of the stacked gradients, scored
+        per layer or, with `aggregate_scope=model`, once over the whole model
+        '''
         krum_start = time.time()
-        for g_idx, grads in enumerate(self._grad_aggregate_buffer):
-            krum_median = __krum(grads, self._s)
-            self._grad_aggregate_buffer[g_idx] = krum_median
-        print("Master Step: {} Krum Cost: {:.4f}".format(self.cur_step, time.time()-krum_start))
\ No newline at end of file
+        stacked_grads = [self._stacked_grads(g_idx) for g_idx in range(len(self._grad_aggregate_buffer))]
+        if self._aggregate_scope == "model":
+            selected = krum_select(stacked_grads, self._s, self._multi_krum_m)
+        for g_idx, grads in enumerate(stacked_grads):
+            if self._aggregate_scope != "model":
+                selected = krum_select([grads], self._s, self._multi_krum_m)
+            self._grad_aggregate_buffer[g_idx] = grads[selected].mean(axis=0)
+        print("Master Step: {} Krum Cost: {:.4f}".format(self.cur_step, time.time()-krum_start))
+
+    def _coordinate_wise(self):
+        '''coordinate-wise median or beta-trimmed mean of the stacked gradients of every layer'''
+        method_start = time.time()
+        if self._aggregate_pool is None and self._aggregate_threads != 1:
+            # `None` lets the pool use every core
+            self._aggregate_pool = ThreadPool(self._aggregate_threads if self._aggregate_threads > 0 else None)
+        for g_idx in range(len(self._grad_aggregate_buffer)):
+            grads = self._stacked_grads(g_idx)
+            if self._update_mode == "coord_median":
+                self._grad_aggregate_buffer[g_idx] = coordinate_median(grads, self._aggregate_chunk_size, self._aggregate_pool)
+            else:
+                self._grad_aggregate_buffer[g_idx] = trimmed_mean(grads, self._trim_beta, self._aggregate_chunk_size, self._aggregate_pool)
+        print("Master Step: {} Coordinate-wise {} Cost: {:.4f}".format(self.cur_step, self._update_mode, time.time()-method_start))
\ No newline at end of file
@@ -1,3 +1,5 @@
+from collections import OrderedDict
+
 from .utils import *
 from .baseline_master import SyncReplicasMaster_NN
 
@@ -24,22 +26,45 @@ class CyclicMaster(SyncReplicasMaster_NN):
         self._update_mode = "normal"
         self._max_steps = kwargs['max_steps']
         self._compress_grad = kwargs['compress_grad']
+        self._bucket_grad = kwargs['bucket_grad']
+        self._bucket_cap_mb = kwargs['bucket_cap_mb']
+        # coded gradients only arrive as raw buffers in bucketed mode, must match the workers
+        self._persistent_comm = kwargs['persistent_comm'] and self._bucket_grad
+        self._fetch_requests = None
+        self._weight_requests = None
+        self._wire = WireFormat(kwargs['wire_dtype'])
+        self._weight_send_buf = None
+        # step and weights in one message with comm-type Packet, allocated on first use
+        self._model_packet = None
+        self._compress_threads = kwargs['compress_threads']
+        # decode every layer separately or all of them at once (the adversaries are the same for every layer)
+        self._aggregate_scope = kwargs['aggregate_scope']
+        # real valued (DCT) code: coded gradients arrive and are decoded as float32 instead of complex
+        self._real_code = kwargs['real_code']
+        self._coded_dtype = np.float32 if self._real_code else np.complex64
         self._W_perp = kwargs['W_perp']
         self._W = kwargs['W']
         self._S = kwargs['decoding_S']
 
         self._C_1 = kwargs['C_1']
-
-        self._estimator = self._estimator_generator(self.num_workers, self.s) # n by s+1 complex matrix
-        self._poly_a = np.zeros(self.s+1, dtype=complex)
-        self._poly_a[-1] = 1+0j
+        # relative size of the syndrome W_perp R below which a step counts as free of adversaries
+        self._syndrome_tol = kwargs['syndrome_tol']
+        # how often the syndrome check let decoding skip the error locator, and how often it did not
+        self._clean_decodes = 0
+        self._full_decodes = 0
+        # LRU cache from the suspected adversaries to their recovery vector `_recover_final`
+        self._recover_cache = OrderedDict()
+        self._recover_cache_size = kwargs['recover_cache_size']
+        self._recover_cache_hits = 0
+        self._recover_cache_misses = 0
+
+        self._estimator = self._estimator_generator(self.num_workers, self.s) # n by s+1 complex (real for the real code) matrix
+        self._poly_a = np.zeros(self.s+1, dtype=self._estimator.dtype)
+        self._poly_a[-1] = 1
         # 1 by n-2s
         self._row_vec = np.zeros((1, self.num_workers-2*self.s))
         self._row_vec[0][0]=1
 
-        self.vec = np.zeros(self.num_workers-2*self.s)
-        self.vec[0] = 1
-
     def build_model(self):
         # build network
         if self.network_config == "LeNet":
@@ -53,24 +78,27 @@ class CyclicMaster(SyncReplicasMaster_NN):
 
         # assign a gradient accumulator to collect gradients from workers
         self.optimizer = SGDModified(self.network.parameters(), lr=self.lr, momentum=self.momentum)
-        self.grad_accumulator = GradientAccumulator(self.network, self.world_size-1, mode=self._compress_grad)
+        self.init_bucket(dtype=self._coded_dtype)
+        self.grad_accumulator = GradientAccumulator(self.network, self.world_size-1, mode=self._compress_grad, bucket=self._bucket, persistent=self._persistent_comm, dtype=self._coded_dtype)
+        self.init_gatherer()
         self.init_model_shapes()
-        self._rand_factors = []
-        for param in self.network.parameters():
-            _dim = reduce(lambda x, y: x * y, param.size())
-            self._rand_factors.append(np.random.normal(loc=1.0, size=_dim))
+        # one random projection vector over the whole model, each layer uses its own slice
+        self._rand_factor = np.random.normal(loc=1.0, size=self._offsets[-1]).astype(self._R_model.real.dtype)
+        self._rand_factors = [self._rand_factor[start:end] for start, end in zip(self._offsets[:-1], self._offsets[1:])]
 
     def init_model_shapes(self):
         tmp_aggregate_buffer = []
-        # received gradient matrix
-        self._R = []
+        # column offsets of every layer in the flattened model
+        self._offsets = [0]
         for param_idx, param in enumerate(self.network.parameters()):
             _shape = param.size()
             self._model_shapes.append(_shape)
             self._grad_aggregate_buffer.append(np.zeros(_shape))
             tmp_aggregate_buffer.append(np.zeros(_shape))
-            # construct R
-            self._R.append(np.zeros((self.num_workers, reduce(lambda x, y: x * y, _shape)),dtype=complex))
+            self._offsets.append(self._offsets[-1]+reduce(lambda x, y: x * y, _shape))
+        # received gradient matrix of the whole model, n by D, R of every layer is a column block (view) of it
+        self._R_model = np.zeros((self.num_workers, self._offsets[-1]), dtype=np.float32 if self._real_code else complex)
+        self._R = [self._R_model[:, start:end] for start, end in zip(self._offsets[:-1], self._offsets[1:])]
 
     def start(self):
         # the first step we need to do here is to sync fetch the inital worl_step from the parameter server
@@ -80,53 +108,37 @@ class CyclicMaster(SyncReplicasMaster_NN):
         for i in range(1, self._max_steps+1):
             # switch back to training mode
             self.network.train()
-            self._first_grad_received = False
-            enough_gradients_received = False
 
             print("Master node is entering step: {}".format(i))
 
-            self.async_bcast_step()
-            self.async_bcast_layer_weights_bcast()
+            packet_request = None
+            if self.comm_type == "Packet":
+                packet_request = self.bcast_model_packet()
+            else:
+                self.async_bcast_step()
+                self.async_bcast_layer_weights_bcast()
             
             # set the gradient fetch step and gather the request
             gradient_fetch_requests=self.async_fetch_gradient_start()
+            if packet_request is not None:
+                # gradient receives are already posted while the packet is on its way
+                packet_request.Wait()
             # wait for enough gradients to be aggregated:
-            while not enough_gradients_received:
-                status = MPI.Status()
-                if self._compress_grad == "None":
-                    MPI.Request.Waitany(requests=gradient_fetch_requests, status=status)
-                elif self._compress_grad == "compress":
-                    _, received_msg=MPI.Request.waitany(requests=gradient_fetch_requests, status=status)
-                    received_grad=decompress(received_msg)
-
-
-                if status.tag-88 in self.grad_accumulator.model_index_range:
-                    if not self._first_grad_received:
-                        self._first_grad_received=True
-                        grad_gather_start_time = time.time()
-
-                    layer_index = status.tag-88
-
-                    if self._compress_grad == "None":
-                        received_grad=self.grad_accumulator.gradient_aggregator[layer_index][status.source-1]
-                    # do gradient shape check here
-                    assert (received_grad.shape == self._model_shapes[layer_index])
-                    
-                    # aggregate the gradient
-                    if self.grad_accumulator.gradient_aggregate_counter[layer_index] <= self._num_grad_to_collect:
-                        self._fill_R(layer_index, status.source, received_grad)
-
-                    self.grad_accumulator.gradient_aggregate_counter[layer_index] += 1
-                
-                enough_gradients_received = True
-                for j in self.grad_accumulator.gradient_aggregate_counter:
-                    enough_gradients_received = enough_gradients_received and (j >= self._num_grad_to_collect)
+            gather_duration = self.gatherer.gather(gradient_fetch_requests, self._fetch_request_layers, self._handle_gradient)
             
             method_start = time.time()
-            for layer_index, R in enumerate(self._R):
-                decoded_grad=self._decoding(R, self._rand_factors[layer_index])
-                self._grad_aggregate_buffer[layer_index] = np.real(decoded_grad)/self.num_workers
+            if self._aggregate_scope == "model":
+                # one error location, one recovery vector and one matmul for all layers
+                decoded_model = self._decoding(self._R_model, self._rand_factor)
+                for layer_index, (start, end) in enumerate(zip(self._offsets[:-1], self._offsets[1:])):
+                    self._grad_aggregate_buffer[layer_index] = np.real(decoded_model[start:end])/self.num_workers
+            else:
+                for layer_index, R in enumerate(self._R):
+                    decoded_grad=self._decoding(R, self._rand_factors[layer_index])
+                    self._grad_aggregate_buffer[layer_index] = np.real(decoded_grad)/self.num_workers
             method_duration = time.time()-method_start
+            print("Master Step: {}, Clean Decodes: {}, Full Decodes: {}, Recover Cache Hits: {}, Recover Cache Misses: {}".format(
+                self.cur_step, self._clean_decodes, self._full_decodes, self._recover_cache_hits, self._recover_cache_misses))
 
             update_start = time.time()
 
@@ -140,9 +152,14 @@ class CyclicMaster(SyncReplicasMaster_NN):
             # save model for validation in a pre-specified frequency
             if self.cur_step%self._eval_freq == 0:
                 self._save_model(file_path=self._generate_model_path())
-            print("Master Step: {}, Method Time Cost: {}, Update Time Cost: {}".format(self.cur_step, method_duration, update_duration))
+            print("Master Step: {}, Gather Time Cost: {}, Method Time Cost: {}, Update Time Cost: {}".format(self.cur_step, gather_duration, method_duration, update_duration))
             self.cur_step += 1
 
+    def _handle_gradient(self, layer_index, source, received_grad):
+        # do gradient shape check here
+        assert (received_grad.shape == self._model_shapes[layer_index])
+        self._fill_R(layer_index, source, received_grad)
+
     def _fill_R(self, layer_index, src, recv_grad):
         recv_grad = recv_grad.reshape((reduce(lambda x, y: x * y, recv_grad.shape),))
         # sanity check
@@ -150,28 +167,58 @@ class CyclicMaster(SyncReplicasMaster_NN):
         self._R[layer_index][src-1] = recv_grad
 
     def _decoding(self, R, random_factor):
-        _recover_final = np.zeros((1, self.num_workers), dtype=complex)
         E_combined = np.dot(R, random_factor)
 
-        # move this part to wrapped C code:
-        alpha = c_coding.solve_poly_a(n=self.num_workers, s=self.s, R=E_combined)
+        # W_perp W = 0, so the syndrome of the projection only sees the errors. Without errors every
+        # worker is usable and S = e_0 C_1^H (S W = 1) recovers the sum of the gradients directly
+        syndrome = np.dot(self._W_perp, E_combined)
+        if np.linalg.norm(syndrome) <= self._syndrome_tol*np.linalg.norm(E_combined):
+            self._clean_decodes += 1
+            return np.dot(self._S.astype(R.dtype), R)[0]
+        self._full_decodes += 1
+
+        if self._real_code:
+            alpha = solve_poly_a_real(n=self.num_workers, s=self.s, R=E_combined)
+        else:
+            alpha = solve_poly_a(n=self.num_workers, s=self.s, R=E_combined)
 
         self._poly_a[0:self.s] = -alpha.reshape(-1)
         estimation = np.dot(self._estimator, self._poly_a)
 
-        err_indices = [i for i, elem in enumerate(estimation) if (np.absolute(elem.real) > 1e-9 or np.absolute(elem.imag) > 1e-9)]
-
-        recover=self._C_1.take(err_indices, axis=0).take(np.arange(self.num_workers-2*self.s),axis=0)
+        if self._real_code:
+            # the Chebyshev nodes cluster near +-1, so rank instead of thresholding: the s workers closest
+            # to a root of the locator are left out, at worst that drops honest workers we do not need
+            suspected = set(np.argsort(np.absolute(estimation), kind='mergesort')[:self.s])
+            err_indices = [i for i in range(self.num_workers) if i not in suspected]
+        else:
+            err_indices = [i for i, elem in enumerate(estimation) if (np.absolute(elem.real) > 1e-9 or np.absolute(elem.imag) > 1e-9)]
 
-        res = lsq_linear(np.transpose(recover), self.vec)
-        new_v = np.transpose(res.x)
-        
-        remaining_indices = err_indices[0:self.num_workers-2*self.s]
-
-        _recover_final[0][[remaining_indices]] = new_v
-        decoded_grad = np.dot(_recover_final, R)
+        _recover_final = self._recover_vector(err_indices)
+        decoded_grad = np.dot(_recover_final.astype(R.dtype), R)
         return decoded_grad[0]
 
+    def _recover_vector(self, err_indices):
+        '''
+        recovery vector using the workers in `err_indices` (the ones the error locator does not vanish on),
+        looked up in the LRU cache keyed by the remaining, suspected faulty, workers
+        '''
+        suspected = tuple(sorted(set(range(self.num_workers))-set(err_indices)))
+        if suspected in self._recover_cache:
+            self._recover_cache_hits += 1
+            # re-insert to mark it as most recently used
+            _recover_final = self._recover_cache.pop(suspected)
+            self._recover_cache[suspected] = _recover_final
+            return _recover_final
+        self._recover_cache_misses += 1
+
+        _recover_final = recovery_vector(self._C_1, err_indices).reshape(1, self.num_workers)
+        if self._recover_cache_size > 0:
+            if len(self._recover_cache) >= self._recover_cache_size:
+                # evict the least recently used pattern
+                self._recover_cache.popitem(last=False)
+            self._recover_cache[suspected] = _recover_final
+        return _recover_final
+
     def _obtain_E(self, alpha, E_2, s):
         # obtain E_1 in shape of n-2s by d
         self._tmp_y = np.zeros((E_2.shape[1], self.num_workers-s), dtype=complex)
@@ -188,6 +235,10 @@ class CyclicMaster(SyncReplicasMaster_NN):
         return FT.ifft(E, axis=0)
 
     def _estimator_generator(self, n, s):
+        if self._real_code:
+            # powers of the Chebyshev nodes the real code evaluates its polynomials at
+            x, _ = chebyshev_nodes(n)
+            return np.power(x[:, None], np.arange(s+1)[None, :])
         estimator = np.zeros((n, s+1), dtype=complex)
         #z_gen_func = np.vectorize(lambda t: np.exp(-2*np.pi*t*1j/n))
         z_gen_func = np.vectorize(lambda t: np.exp(2*np.pi*t*1j/n))
@@ -24,6 +24,17 @@ class CodedMaster(SyncReplicasMaster_NN):
         self._max_steps = kwargs['max_steps']
         self._group_list = kwargs['group_list']
         self._compress_grad = kwargs['compress_grad']
+        self._bucket_grad = kwargs['bucket_grad']
+        self._bucket_cap_mb = kwargs['bucket_cap_mb']
+        # persistent requests need raw (uncompressed or bucketed) receive buffers
+        self._persistent_comm = kwargs['persistent_comm'] and (self._compress_grad == 'None' or self._bucket_grad)
+        self._fetch_requests = None
+        self._weight_requests = None
+        self._wire = WireFormat(kwargs['wire_dtype'])
+        self._weight_send_buf = None
+        # step and weights in one message with comm-type Packet, allocated on first use
+        self._model_packet = None
+        self._compress_threads = kwargs['compress_threads']
         self._group_size = len(self._group_list[0])
 
     def build_model(self):
@@ -40,7 +51,9 @@ class CodedMaster(SyncReplicasMaster_NN):
             self.network=FC_NN_Split()
 
         # assign a gradient accumulator to collect gradients from workers
-        self.grad_accumulator = GradientAccumulator(self.network, self.world_size-1, mode=self._compress_grad)
+        self.init_bucket()
+        self.grad_accumulator = GradientAccumulator(self.network, self.world_size-1, mode=self._compress_grad, bucket=self._bucket, persistent=self._persistent_comm, wire=self._wire)
+        self.init_gatherer()
         self.init_model_shapes()
         self.optimizer = SGDModified(self.network.parameters(), lr=self.lr, momentum=self.momentum)
 
@@ -49,8 +62,8 @@ class CodedMaster(SyncReplicasMaster_NN):
         for param_idx, param in enumerate(self.network.parameters()):
             shape = param.size()
             self._model_shapes.append(shape)
-            self._grad_aggregate_buffer.append(np.zeros(shape))
-            tmp_aggregate_buffer.append(np.zeros(shape))
+            self._grad_aggregate_buffer.append(np.zeros(shape, dtype=self._wire.compute_dtype))
+            tmp_aggregate_buffer.append(np.zeros(shape, dtype=self._wire.compute_dtype))
 
         if self._update_mode == "maj_vote":
             for k, v in self._group_list.iteritems():
@@ -69,11 +82,13 @@ class CodedMaster(SyncReplicasMaster_NN):
         for i in range(1, self._max_steps+1):
             # switch back to training mode
             self.network.train()
-            self._first_grad_received = False
-            enough_gradients_received = False
 
             print("Master node is entering step: {}".format(i))
-            self.async_bcast_step()
+            packet_request = None
+            if self.comm_type == "Packet":
+                packet_request = self.bcast_model_packet()
+            else:
+                self.async_bcast_step()
 
             if self.comm_type == "Bcast":
                 self.async_bcast_layer_weights_bcast()
@@ -82,36 +97,11 @@ class CodedMaster(SyncReplicasMaster_NN):
             
             # set the gradient fetch step and gather the request
             gradient_fetch_requests=self.async_fetch_gradient_start()
+            if packet_request is not None:
+                # gradient receives are already posted while the packet is on its way
+                packet_request.Wait()
             # wait for enough gradients to be aggregated:
-            while not enough_gradients_received:
-                status = MPI.Status()
-                if self._compress_grad == "None":
-                    MPI.Request.Waitany(requests=gradient_fetch_requests, status=status)
-                elif self._compress_grad == "compress":
-                    _, received_msg=MPI.Request.waitany(requests=gradient_fetch_requests, status=status)
-                    received_grad=decompress(received_msg)
-
-                if status.tag-88 in self.grad_accumulator.model_index_range:
-                    if not self._first_grad_received:
-                        self._first_grad_received=True
-                        grad_gather_start_time = time.time()
-
-                    layer_index = status.tag-88
-
-                    if self._compress_grad == "None":
-                        received_grad=self.grad_accumulator.gradient_aggregator[layer_index][status.source-1]
-                    # do gradient shape check here
-                    assert (received_grad.shape == self._model_shapes[layer_index])
-
-                    # aggregate the gradient
-                    if self.grad_accumulator.gradient_aggregate_counter[layer_index] <= self._num_grad_to_collect:
-                        self.aggregate_gradient(received_grad, layer_index, status.source)
-
-                    self.grad_accumulator.gradient_aggregate_counter[layer_index] += 1
-                
-                enough_gradients_received = True
-                for j in self.grad_accumulator.gradient_aggregate_counter:
-                    enough_gradients_received = enough_gradients_received and (j >= self._num_grad_to_collect)
+            gather_duration = self.gatherer.gather(gradient_fetch_requests, self._fetch_request_layers, self._handle_gradient)
             
             if self._update_mode == "normal":
                 method_start = time.time()
@@ -135,9 +125,14 @@ class CodedMaster(SyncReplicasMaster_NN):
             # save model for validation in a pre-specified frequency
             if self.cur_step%self._eval_freq == 0:
                 self._save_model(file_path=self._generate_model_path())
-            print("Master Step: {}, Method Time Cost: {}, Update Time Cost: {}".format(self.cur_step, method_duration, update_duration))
+            print("Master Step: {}, Gather Time Cost: {}, Method Time Cost: {}, Update Time Cost: {}".format(self.cur_step, gather_duration, method_duration, update_duration))
             self.cur_step += 1
 
+    def _handle_gradient(self, layer_index, source, received_grad):
+        # do gradient shape check here
+        assert (received_grad.shape == self._model_shapes[layer_index])
+        self.aggregate_gradient(received_grad, layer_index, source)
+
     def aggregate_gradient(self, gradient, layer_idx, source):
         '''
         keep in mind the gradient here is wrapped gradient, which means it contains `W` and `b`
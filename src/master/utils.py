@@ -1,11 +1,10 @@
 from __future__ import print_function
 import time
 import copy
-from sys import getsizeof
+from multiprocessing.pool import ThreadPool
 
 from mpi4py import MPI
 import numpy as np
-import hdmedians as hd
 from scipy import linalg as LA
 from scipy import fftpack as FT
 from scipy.optimize import lsq_linear
@@ -15,8 +14,17 @@ import sys
 sys.path.append("..")
 from nn_ops import NN_Trainer
 from optim.sgd_modified import SGDModified
-from compress_gradient import decompress
-import c_coding
+from compress_gradient import decompress, frame_capacity, set_nthreads
+from bucket_gradient import GradientBucket, MPI_TYPES_
+from wire_format import WireFormat
+from model_packet import ModelPacket
+from robust_aggregation import krum_select, weiszfeld, coordinate_median, trimmed_mean
+try:
+    # compiled error locator (`c_coding.cpp`), the NumPy version in `coding` is used when it is not built
+    from c_coding import solve_poly_a
+except ImportError:
+    from coding import solve_poly_a
+from coding import solve_poly_a_real, chebyshev_nodes, recovery_vector
 from util import *
 
 
@@ -39,7 +47,7 @@ def accuracy(output, target, topk=(1,)):
 
 class GradientAccumulator(object):
     '''a simple class to implement gradient aggregator like the `Conditional Accumulators` in tensorflow'''
-    def __init__(self, module, num_worker, mode='None'):
+    def __init__(self, module, num_worker, mode='None', bucket=None, persistent=False, wire=None, dtype=np.float64):
         # we will update this counter dynamically during the training process
         # the length of this counter should be number of fc layers in the network
         # we used list to contain gradients of layers
@@ -47,23 +55,84 @@ class GradientAccumulator(object):
         self.model_index_range = []
         self.gradient_aggregator = []
         self._mode = mode
-        
+        self._bucket = bucket
+        # buffers are bound to persistent receives, so they must never be reallocated
+        self._persistent = persistent
+        # gradients arrive in the wire dtype, `None` means raw `dtype`
+        self._wire = wire
+        self._dtype = np.dtype(dtype) if wire is None else wire.dtype
+        # 16-bit wire formats are decoded once per received gradient into these compute buffers
+        self.decoded_aggregator = None
+        # raw blosc frames are received into these byte buffers, then decompressed into `gradient_aggregator`
+        self.compressed_aggregator = None
+        if self.compressed:
+            self.compressed_aggregator = []
+
+        if self._bucket is not None:
+            # one row per worker, buckets are received straight into the rows and
+            # every layer buffer in `gradient_aggregator` is a view into them
+            self.gradient_matrix = np.zeros((num_worker, self._bucket.total_size), dtype=self._bucket.dtype)
+            if self.needs_decode:
+                self.decoded_matrix = np.zeros((num_worker, self._bucket.total_size), dtype=wire.compute_dtype)
+        if self.needs_decode:
+            self.decoded_aggregator = []
+
         for param_idx, param in enumerate(module.parameters()):
             tmp_aggregator = []
             for worker_idx in range(num_worker):
-                if self._mode == 'None':
-                    tmp_aggregator.append(np.zeros((param.size())))
-                elif self._mode == 'compress':
-                    _shape = param.size()
-                    if len(_shape) == 1:
-                        tmp_aggregator.append(bytearray(getsizeof(np.zeros((_shape[0],)))*2))
-                    else:
-                        tmp_aggregator.append(bytearray(getsizeof(np.zeros(_shape))*2))
+                if self._bucket is not None:
+                    tmp_aggregator.append(self._bucket.layer_view(self.gradient_matrix[worker_idx], param_idx))
+                elif self._mode in ('None', 'compress'):
+                    tmp_aggregator.append(np.zeros((param.size()), dtype=self._dtype))
             # initialize the gradient aggragator
             self.gradient_aggregator.append(tmp_aggregator)
+            if self.compressed_aggregator is not None:
+                _capacity = frame_capacity(tmp_aggregator[0].nbytes)
+                self.compressed_aggregator.append([np.zeros(_capacity, dtype=np.uint8) for worker_idx in range(num_worker)])
+            if self.decoded_aggregator is not None:
+                if self._bucket is not None:
+                    self.decoded_aggregator.append([self._bucket.layer_view(self.decoded_matrix[worker_idx], param_idx) for worker_idx in range(num_worker)])
+                else:
+                    self.decoded_aggregator.append([np.zeros((param.size()), dtype=wire.compute_dtype) for worker_idx in range(num_worker)])
             self.gradient_aggregate_counter.append(0)
             self.model_index_range.append(param_idx)
 
+    @property
+    def needs_decode(self):
+        return self._wire is not None and self._wire.needs_decode
+
+    @property
+    def compressed(self):
+        '''gradients arrive as raw blosc frames (bucketed gradients are never compressed)'''
+        return self._mode == 'compress' and self._bucket is None
+
+    @property
+    def mpi_type(self):
+        '''MPI datatype the raw (uncompressed) gradients are received with'''
+        return MPI_TYPES_[self._dtype] if self._wire is None else self._wire.mpi_type
+
+    def decompress_received(self, layer_index, source):
+        '''decompress the frame received from `source` in place into its preallocated gradient buffer'''
+        return decompress(self.compressed_aggregator[layer_index][source-1], self.gradient_aggregator[layer_index][source-1])
+
+    def layer_matrix(self, layer_index):
+        '''
+        (num_worker, layer size) view of every worker's gradient of a layer in the compute dtype,
+        only bucketed receives keep the layers of all workers in one matrix, `None` otherwise
+        '''
+        if self._bucket is None:
+            return None
+        matrix = self.decoded_matrix if self.needs_decode else self.gradient_matrix
+        start = self._bucket.offsets[layer_index]
+        return matrix[:, start:start+self._bucket.sizes[layer_index]]
+
+    def received_gradient(self, layer_index, source):
+        '''gradient of layer `layer_index` received from `source`, in the compute dtype'''
+        received_grad = self.gradient_aggregator[layer_index][source-1]
+        if not self.needs_decode:
+            return received_grad
+        return self._wire.decode(received_grad, self.decoded_aggregator[layer_index][source-1])
+
     def meset_everything(self):
         self._meset_grad_counter()
         self._meset_grad_aggregator()
@@ -75,9 +144,53 @@ class GradientAccumulator(object):
         '''
         reset the buffers in grad accumulator, not sure if this is necessary
         '''
-        if self._mode == 'compress':
+        if self._mode == 'compress' or self._bucket is not None or self._persistent:
+            # decompression targets, bucketed rows and persistent receive buffers are fully overwritten by the next receive
             pass
         else:
             for i, tmp_aggregator in enumerate(self.gradient_aggregator):
                 for j, buf in enumerate(tmp_aggregator):
-                    self.gradient_aggregator[i][j] = np.zeros(self.gradient_aggregator[i][j].shape)
\ No newline at end of file
+                    self.gradient_aggregator[i][j] = np.zeros(self.gradient_aggregator[i][j].shape, dtype=self.gradient_aggregator[i][j].dtype)
+
+
+class GradientGatherer(object):
+    '''
+    completion engine for one step of gradient gathering, finished receives are drained in
+    batches with `Waitsome` and per-layer completion counts are kept incrementally, so we
+    return as soon as every layer got `num_grad_to_collect` gradients without rescanning
+    the request list or the counters after every single message
+    '''
+    def __init__(self, accumulator, num_grad_to_collect, compressed=False):
+        self._accumulator = accumulator
+        self._num_grad_to_collect = num_grad_to_collect
+        # requests receive raw blosc frames instead of raw gradients
+        self._compressed = compressed
+
+    def gather(self, requests, request_layers, handler):
+        '''
+        requests: receive requests posted for this step
+        request_layers: `(source, layer indices)` carried by every request, in the order of `requests`
+        handler: called as `handler(layer_index, source, received_grad)` for every received gradient
+        returns the wall time spent gathering
+        '''
+        gather_start = time.time()
+        counter = self._accumulator.gradient_aggregate_counter
+        accumulator = self._accumulator
+        layers_remaining = sum(1 for c in counter if c < self._num_grad_to_collect)
+        while layers_remaining > 0:
+            indices = MPI.Request.Waitsome(requests)
+            if indices is None:
+                # every request is inactive, nothing more will arrive in this step
+                break
+            for req_idx in indices:
+                source, layer_indices = request_layers[req_idx]
+                for layer_index in layer_indices:
+                    if self._compressed:
+                        accumulator.decompress_received(layer_index, source)
+                    received_grad = accumulator.received_gradient(layer_index, source)
+                    if counter[layer_index] <= self._num_grad_to_collect:
+                        handler(layer_index, source, received_grad)
+                    counter[layer_index] += 1
+                    if counter[layer_index] == self._num_grad_to_collect:
+                        layers_remaining -= 1
+        return time.time() - gather_start
@@ -130,13 +130,13 @@ class LeNetSplit(nn.Module):
                         simulation_grad = err_simulation(grad=grads, mode=err_mode)
                         if compress_grad == 'compress':
                             _compressed_grad = compress(simulation_grad)
-                            req_isend = communicator.isend(_compressed_grad, dest=0, tag=88+channel_index)
+                            req_isend = communicator.Isend([_compressed_grad, MPI.BYTE], dest=0, tag=88+channel_index)
                         else:
                             req_isend = communicator.Isend([simulation_grad, MPI.DOUBLE], dest=0, tag=88+channel_index)
                     else:
                         if compress_grad == 'compress':
                             _compressed_grad = compress(grads)
-                            req_isend = communicator.isend(_compressed_grad, dest=0, tag=88+channel_index)
+                            req_isend = communicator.Isend([_compressed_grad, MPI.BYTE], dest=0, tag=88+channel_index)
                         else:                     
                             req_isend = communicator.Isend([grads, MPI.DOUBLE], dest=0, tag=88+channel_index)
                     #########################################################################################
@@ -159,13 +159,13 @@ class LeNetSplit(nn.Module):
                             simulation_grad = err_simulation(grad=grads, mode=err_mode)
                             if compress_grad == 'compress':
                                 _compressed_grad = compress(simulation_grad)
-                                req_isend = communicator.isend(_compressed_grad, dest=0, tag=88+channel_index)
+                                req_isend = communicator.Isend([_compressed_grad, MPI.BYTE], dest=0, tag=88+channel_index)
                             else:
                                 req_isend = communicator.Isend([simulation_grad, MPI.DOUBLE], dest=0, tag=88+channel_index)
                         else:
                             if compress_grad == 'compress':
                                 _compressed_grad = compress(grads)
-                                req_isend = communicator.isend(_compressed_grad, dest=0, tag=88+channel_index)
+                                req_isend = communicator.Isend([_compressed_grad, MPI.BYTE], dest=0, tag=88+channel_index)
                             else:                     
                                 req_isend = communicator.Isend([grads, MPI.DOUBLE], dest=0, tag=88+channel_index)
                         #########################################################################################
@@ -179,13 +179,13 @@ class LeNetSplit(nn.Module):
                             simulation_grad = err_simulation(grad=grads, mode=err_mode)
                             if compress_grad == 'compress':
                                 _compressed_grad = compress(simulation_grad)
-                                req_isend = communicator.isend(_compressed_grad, dest=0, tag=88+channel_index)
+                                req_isend = communicator.Isend([_compressed_grad, MPI.BYTE], dest=0, tag=88+channel_index)
                             else:
                                 req_isend = communicator.Isend([simulation_grad, MPI.DOUBLE], dest=0, tag=88+channel_index)
                         else:
                             if compress_grad == 'compress':
                                 _compressed_grad = compress(grads)
-                                req_isend = communicator.isend(_compressed_grad, dest=0, tag=88+channel_index)
+                                req_isend = communicator.Isend([_compressed_grad, MPI.BYTE], dest=0, tag=88+channel_index)
                             else:                     
                                 req_isend = communicator.Isend([grads, MPI.DOUBLE], dest=0, tag=88+channel_index)
                         #########################################################################################
@@ -204,13 +204,13 @@ class LeNetSplit(nn.Module):
                 simulation_grad = err_simulation(grad=grads, mode=err_mode)
                 if compress_grad == 'compress':
                     _compressed_grad = compress(simulation_grad)
-                    req_isend = communicator.isend(_compressed_grad, dest=0, tag=88+channel_index)
+                    req_isend = communicator.Isend([_compressed_grad, MPI.BYTE], dest=0, tag=88+channel_index)
                 else:
                     req_isend = communicator.Isend([simulation_grad, MPI.DOUBLE], dest=0, tag=88+channel_index)
             else:
                 if compress_grad == 'compress':
                     _compressed_grad = compress(grads)
-                    req_isend = communicator.isend(_compressed_grad, dest=0, tag=88+channel_index)
+                    req_isend = communicator.Isend([_compressed_grad, MPI.BYTE], dest=0, tag=88+channel_index)
                 else:                     
                     req_isend = communicator.Isend([grads, MPI.DOUBLE], dest=0, tag=88+channel_index)
             #########################################################################################
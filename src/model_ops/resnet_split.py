@@ -22,6 +22,7 @@ import sys
 sys.path.insert(0, '../compress_gradient')
 from compress_gradient import compress
 from utils import err_simulation
+from wire_format import WireFormat
 
 LAYER_DIGITS= int(1e+3)
 TIMEOUT_THRESHOLD_=10
@@ -428,7 +429,10 @@ class ResNetSplit(nn.Module):
                     mod_avail_index-=1
         return req_send_check
 
-    def backward_normal(self, g, communicator, req_send_check, cur_step, fail_workers, err_mode, compress_grad):
+    def backward_normal(self, g, communicator, req_send_check, cur_step, fail_workers, err_mode, compress_grad, wire=None):
+        # gradients are sent in the wire dtype, float64 unless told otherwise
+        if wire is None:
+            wire = WireFormat()
         mod_avail_index = len(self.full_modules)-1
         channel_index = self._init_channel_index-2
         mod_counters_ = [0]*len(self.full_modules)
@@ -441,21 +445,21 @@ class ResNetSplit(nn.Module):
                 # get gradient here after some sanity checks:
                 tmp_grad = self.full_modules[mod_avail_index].weight.grad
                 if not pd.isnull(tmp_grad):
-                    grads = tmp_grad.data.numpy().astype(np.float64)
+                    grads = tmp_grad.data.numpy()
                     ######################################################################################
                     if communicator.Get_rank() in fail_workers:
                         simulation_grad = err_simulation(grad=grads, mode=err_mode)
                         if compress_grad == 'compress':
-                            _compressed_grad = compress(simulation_grad)
-                            req_isend = communicator.isend(_compressed_grad, dest=0, tag=88+channel_index)
+                            _compressed_grad = compress(wire.cast(simulation_grad))
+                            req_isend = communicator.Isend([_compressed_grad, MPI.BYTE], dest=0, tag=88+channel_index)
                         else:
-                            req_isend = communicator.Isend([simulation_grad, MPI.DOUBLE], dest=0, tag=88+channel_index)                    
+                            req_isend = communicator.Isend([wire.cast(simulation_grad), wire.mpi_type], dest=0, tag=88+channel_index)                    
                     else:
                         if compress_grad == 'compress':
-                            _compressed_grad = compress(grads)
-                            req_isend = communicator.isend(_compressed_grad, dest=0, tag=88+channel_index)
+                            _compressed_grad = compress(wire.cast(grads))
+                            req_isend = communicator.Isend([_compressed_grad, MPI.BYTE], dest=0, tag=88+channel_index)
                         else:
-                            req_isend = communicator.Isend([grads, MPI.DOUBLE], dest=0, tag=88+channel_index)
+                            req_isend = communicator.Isend([wire.cast(grads), wire.mpi_type], dest=0, tag=88+channel_index)
                     ######################################################################################
                     req_send_check.append(req_isend)
                     # update counters
@@ -475,21 +479,21 @@ class ResNetSplit(nn.Module):
                     tmp_grad_weight = self.full_modules[mod_avail_index].weight.grad
 
                     if not pd.isnull(tmp_grad_weight):
-                        grads = tmp_grad_weight.data.numpy().astype(np.float64)
+                        grads = tmp_grad_weight.data.numpy()
                         ######################################################################################
                         if communicator.Get_rank() in fail_workers:
                             simulation_grad = err_simulation(grad=grads, mode=err_mode)
                             if compress_grad == 'compress':
-                                _compressed_grad = compress(simulation_grad)
-                                req_isend = communicator.isend(_compressed_grad, dest=0, tag=88+channel_index)
+                                _compressed_grad = compress(wire.cast(simulation_grad))
+                                req_isend = communicator.Isend([_compressed_grad, MPI.BYTE], dest=0, tag=88+channel_index)
                             else:
-                                req_isend = communicator.Isend([simulation_grad, MPI.DOUBLE], dest=0, tag=88+channel_index)                    
+                                req_isend = communicator.Isend([wire.cast(simulation_grad), wire.mpi_type], dest=0, tag=88+channel_index)                    
                         else:
                             if compress_grad == 'compress':
-                                _compressed_grad = compress(grads)
-                                req_isend = communicator.isend(_compressed_grad, dest=0, tag=88+channel_index)
+                                _compressed_grad = compress(wire.cast(grads))
+                                req_isend = communicator.Isend([_compressed_grad, MPI.BYTE], dest=0, tag=88+channel_index)
                             else:
-                                req_isend = communicator.Isend([grads, MPI.DOUBLE], dest=0, tag=88+channel_index)
+                                req_isend = communicator.Isend([wire.cast(grads), wire.mpi_type], dest=0, tag=88+channel_index)
                         ######################################################################################
                         req_send_check.append(req_isend)
                         channel_index-=1
@@ -505,41 +509,41 @@ class ResNetSplit(nn.Module):
                     if not pd.isnull(tmp_grad_weight) and not pd.isnull(tmp_grad_bias):
                         # we always send bias first
                         if mod_counters_[mod_avail_index] == 0:
-                            grads = tmp_grad_bias.data.numpy().astype(np.float64)
+                            grads = tmp_grad_bias.data.numpy()
                             ######################################################################################
                             if communicator.Get_rank() in fail_workers:
                                 simulation_grad = err_simulation(grad=grads, mode=err_mode)
                                 if compress_grad == 'compress':
-                                    _compressed_grad = compress(simulation_grad)
-                                    req_isend = communicator.isend(_compressed_grad, dest=0, tag=88+channel_index)
+                                    _compressed_grad = compress(wire.cast(simulation_grad))
+                                    req_isend = communicator.Isend([_compressed_grad, MPI.BYTE], dest=0, tag=88+channel_index)
                                 else:
-                                    req_isend = communicator.Isend([simulation_grad, MPI.DOUBLE], dest=0, tag=88+channel_index)                    
+                                    req_isend = communicator.Isend([wire.cast(simulation_grad), wire.mpi_type], dest=0, tag=88+channel_index)                    
                             else:
                                 if compress_grad == 'compress':
-                                    _compressed_grad = compress(grads)
-                                    req_isend = communicator.isend(_compressed_grad, dest=0, tag=88+channel_index)
+                                    _compressed_grad = compress(wire.cast(grads))
+                                    req_isend = communicator.Isend([_compressed_grad, MPI.BYTE], dest=0, tag=88+channel_index)
                                 else:
-                                    req_isend = communicator.Isend([grads, MPI.DOUBLE], dest=0, tag=88+channel_index)
+                                    req_isend = communicator.Isend([wire.cast(grads), wire.mpi_type], dest=0, tag=88+channel_index)
                             ######################################################################################
                             req_send_check.append(req_isend)
                             channel_index-=1
                             mod_counters_[mod_avail_index]+=1
                         elif mod_counters_[mod_avail_index] == 1:
-                            grads = tmp_grad_weight.data.numpy().astype(np.float64)
+                            grads = tmp_grad_weight.data.numpy()
                             ######################################################################################
                             if communicator.Get_rank() in fail_workers:
                                 simulation_grad = err_simulation(grad=grads, mode=err_mode)
                                 if compress_grad == 'compress':
-                                    _compressed_grad = compress(simulation_grad)
-                                    req_isend = communicator.isend(_compressed_grad, dest=0, tag=88+channel_index)
+                                    _compressed_grad = compress(wire.cast(simulation_grad))
+                                    req_isend = communicator.Isend([_compressed_grad, MPI.BYTE], dest=0, tag=88+channel_index)
                                 else:
-                                    req_isend = communicator.Isend([simulation_grad, MPI.DOUBLE], dest=0, tag=88+channel_index)                    
+                                    req_isend = communicator.Isend([wire.cast(simulation_grad), wire.mpi_type], dest=0, tag=88+channel_index)                    
                             else:
                                 if compress_grad == 'compress':
-                                    _compressed_grad = compress(grads)
-                                    req_isend = communicator.isend(_compressed_grad, dest=0, tag=88+channel_index)
+                                    _compressed_grad = compress(wire.cast(grads))
+                                    req_isend = communicator.Isend([_compressed_grad, MPI.BYTE], dest=0, tag=88+channel_index)
                                 else:
-                                    req_isend = communicator.Isend([grads, MPI.DOUBLE], dest=0, tag=88+channel_index)
+                                    req_isend = communicator.Isend([wire.cast(grads), wire.mpi_type], dest=0, tag=88+channel_index)
                             ######################################################################################
                             req_send_check.append(req_isend)
                             channel_index-=1
@@ -553,21 +557,21 @@ class ResNetSplit(nn.Module):
             req_send_check[-1].wait()
             if pd.isnull(self.full_modules[mod_avail_index].bias):
                 tmp_grad_weight = self.full_modules[mod_avail_index].weight.grad
-                grads = tmp_grad_weight.data.numpy().astype(np.float64)
+                grads = tmp_grad_weight.data.numpy()
                 ######################################################################################
                 if communicator.Get_rank() in fail_workers:
                     simulation_grad = err_simulation(grad=grads, mode=err_mode)
                     if compress_grad == 'compress':
-                        _compressed_grad = compress(simulation_grad)
-                        req_isend = communicator.isend(_compressed_grad, dest=0, tag=88+channel_index)
+                        _compressed_grad = compress(wire.cast(simulation_grad))
+                        req_isend = communicator.Isend([_compressed_grad, MPI.BYTE], dest=0, tag=88+channel_index)
                     else:
-                        req_isend = communicator.Isend([simulation_grad, MPI.DOUBLE], dest=0, tag=88+channel_index)                    
+                        req_isend = communicator.Isend([wire.cast(simulation_grad), wire.mpi_type], dest=0, tag=88+channel_index)                    
                 else:
                     if compress_grad == 'compress':
-                        _compressed_grad = compress(grads)
-                        req_isend = communicator.isend(_compressed_grad, dest=0, tag=88+channel_index)
+                        _compressed_grad = compress(wire.cast(grads))
+                        req_isend = communicator.Isend([_compressed_grad, MPI.BYTE], dest=0, tag=88+channel_index)
                     else:
-                        req_isend = communicator.Isend([grads, MPI.DOUBLE], dest=0, tag=88+channel_index)
+                        req_isend = communicator.Isend([wire.cast(grads), wire.mpi_type], dest=0, tag=88+channel_index)
                 ######################################################################################
                 req_send_check.append(req_isend)
                 channel_index-=1
@@ -579,41 +583,41 @@ class ResNetSplit(nn.Module):
                 tmp_grad_bias = self.full_modules[mod_avail_index].bias.grad
                 # we always send bias first
                 if mod_counters_[mod_avail_index] == 0:
-                    grads = tmp_grad_bias.data.numpy().astype(np.float64)
+                    grads = tmp_grad_bias.data.numpy()
                     ######################################################################################
                     if communicator.Get_rank() in fail_workers:
                         simulation_grad = err_simulation(grad=grads, mode=err_mode)
                         if compress_grad == 'compress':
-                            _compressed_grad = compress(simulation_grad)
-                            req_isend = communicator.isend(_compressed_grad, dest=0, tag=88+channel_index)
+                            _compressed_grad = compress(wire.cast(simulation_grad))
+                            req_isend = communicator.Isend([_compressed_grad, MPI.BYTE], dest=0, tag=88+channel_index)
                         else:
-                            req_isend = communicator.Isend([simulation_grad, MPI.DOUBLE], dest=0, tag=88+channel_index)                    
+                            req_isend = communicator.Isend([wire.cast(simulation_grad), wire.mpi_type], dest=0, tag=88+channel_index)                    
                     else:
                         if compress_grad == 'compress':
-                            _compressed_grad = compress(grads)
-                            req_isend = communicator.isend(_compressed_grad, dest=0, tag=88+channel_index)
+                            _compressed_grad = compress(wire.cast(grads))
+                            req_isend = communicator.Isend([_compressed_grad, MPI.BYTE], dest=0, tag=88+channel_index)
                         else:
-                            req_isend = communicator.Isend([grads, MPI.DOUBLE], dest=0, tag=88+channel_index)
+                            req_isend = communicator.Isend([wire.cast(grads), wire.mpi_type], dest=0, tag=88+channel_index)
                     ######################################################################################
                     req_send_check.append(req_isend)
                     channel_index-=1
                     mod_counters_[mod_avail_index]+=1
                 elif mod_counters_[mod_avail_index] == 1:
-                    grads = tmp_grad_weight.data.numpy().astype(np.float64)
+                    grads = tmp_grad_weight.data.numpy()
                     ######################################################################################
                     if communicator.Get_rank() in fail_workers:
                         simulation_grad = err_simulation(grad=grads, mode=err_mode)
                         if compress_grad == 'compress':
-                            _compressed_grad = compress(simulation_grad)
-                            req_isend = communicator.isend(_compressed_grad, dest=0, tag=88+channel_index)
+                            _compressed_grad = compress(wire.cast(simulation_grad))
+                            req_isend = communicator.Isend([_compressed_grad, MPI.BYTE], dest=0, tag=88+channel_index)
                         else:
-                            req_isend = communicator.Isend([simulation_grad, MPI.DOUBLE], dest=0, tag=88+channel_index)                    
+                            req_isend = communicator.Isend([wire.cast(simulation_grad), wire.mpi_type], dest=0, tag=88+channel_index)                    
                     else:
                         if compress_grad == 'compress':
-                            _compressed_grad = compress(grads)
-                            req_isend = communicator.isend(_compressed_grad, dest=0, tag=88+channel_index)
+                            _compressed_grad = compress(wire.cast(grads))
+                            req_isend = communicator.Isend([_compressed_grad, MPI.BYTE], dest=0, tag=88+channel_index)
                         else:
-                            req_isend = communicator.Isend([grads, MPI.DOUBLE], dest=0, tag=88+channel_index)
+                            req_isend = communicator.Isend([wire.cast(grads), wire.mpi_type], dest=0, tag=88+channel_index)
                     ######################################################################################
                     req_send_check.append(req_isend)
                     channel_index-=1
@@ -0,0 +1,63 @@
+import numpy as np
+from mpi4py import MPI
+
+from wire_format import WIRE_DTYPES_
+
+# header fields, int64 each, in front of the flat weights
+HEADER_FIELDS_ = ('step', 'version', 'dtype', 'compression')
+# weights are sent raw, other ids are reserved for compressed weight payloads
+COMPRESSION_NONE_ = 0
+
+class ModelPacket(object):
+    def __init__(self, shapes, wire):
+        """
+        the whole model as one message: a small header (step, model version, wire dtype id,
+        compression id) followed by the weights of all layers laid out contiguously in the wire
+        dtype. Master packs the step and its weights once per step and a single `Ibcast` of
+        the packet replaces the per-worker step messages and the per-layer weight broadcasts
+        """
+        self.wire = wire
+        self.shapes = [tuple(s) for s in shapes]
+        self.sizes = [int(np.prod(s)) for s in self.shapes]
+        self.offsets = [int(o) for o in np.cumsum([0]+self.sizes[:-1])]
+        self.total_size = int(sum(self.sizes))
+        header_nbytes = len(HEADER_FIELDS_)*8
+        # one byte buffer, the header and the weights are views on it (the weights stay 8-byte aligned)
+        self.buf = np.zeros(header_nbytes+self.total_size*wire.dtype.itemsize, dtype=np.uint8)
+        self.header = self.buf[:header_nbytes].view(np.int64)
+        self.flat = self.buf[header_nbytes:].view(wire.dtype)
+        self.layers = [self.flat[start:start+size].reshape(shape) for start, size, shape in zip(self.offsets, self.sizes, self.shapes)]
+        # weights in the compute dtype, only allocated for 16-bit wire dtypes
+        self._decoded = None
+
+    def _field(self, name):
+        return int(self.header[HEADER_FIELDS_.index(name)])
+
+    @property
+    def step(self):
+        return self._field('step')
+
+    @property
+    def version(self):
+        return self._field('version')
+
+    def pack(self, step, version, weights):
+        '''write the header and encode per-layer weights (in model parameter order) into the packet'''
+        self.header[:] = [step, version, WIRE_DTYPES_.index(self.wire.name), COMPRESSION_NONE_]
+        for layer, weight in zip(self.layers, weights):
+            self.wire.encode(weight, layer)
+
+    def unpack(self):
+        '''per-layer weights in the compute dtype, views of the packet unless the wire dtype needs decoding'''
+        assert self._field('dtype') == WIRE_DTYPES_.index(self.wire.name), \
+            "model packet is in {}, expected {}".format(WIRE_DTYPES_[self._field('dtype')], self.wire.name)
+        assert self._field('compression') == COMPRESSION_NONE_, "compressed model packets are not supported"
+        if not self.wire.needs_decode:
+            return self.layers
+        if self._decoded is None:
+            self._decoded = [np.zeros(shape, dtype=self.wire.compute_dtype) for shape in self.shapes]
+        return [self.wire.decode(layer, out) for layer, out in zip(self.layers, self._decoded)]
+
+    def ibcast(self, comm, root=0):
+        '''nonblocking broadcast of the whole packet from `root`, returns the request'''
+        return comm.Ibcast([self.buf, MPI.BYTE], root=root)
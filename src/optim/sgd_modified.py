@@ -1,3 +1,4 @@
+import numpy as np
 import torch
 from torch.optim import Optimizer
 
@@ -67,12 +68,14 @@ class SGDModified(Optimizer):
             nesterov = group['nesterov']
 
             for i,p in enumerate(group['params']):
+                # float32 aggregates (any `--wire-dtype` but float64) are wrapped without a copy
                 if mode == 'normal':
-                    d_p = torch.from_numpy(grads[i]).float()
-                elif mode=='geometric_median' or mode=='maj_vote' or mode=='cyclic' or mode=='krum':
-                    d_p = torch.from_numpy(grads[i].reshape(p.size())).float()
+                    d_p = torch.from_numpy(np.ascontiguousarray(grads[i], dtype=np.float32))
+                elif mode=='geometric_median' or mode=='maj_vote' or mode=='cyclic' or mode=='krum' or mode=='coord_median' or mode=='trimmed_mean':
+                    d_p = torch.from_numpy(np.ascontiguousarray(grads[i].reshape(p.size()), dtype=np.float32))
                 if weight_decay != 0:
-                    d_p.add_(weight_decay, p.data)
+                    # out of place, `d_p` may share memory with the master's aggregate buffer
+                    d_p = d_p.add(weight_decay, p.data)
                 if momentum != 0:
                     param_state = self.state[p]
                     if 'momentum_buffer' not in param_state:
@@ -0,0 +1,129 @@
+'''
+byzantine robust aggregation rules on stacked worker gradients, every rule works on
+(n, d) matrices with one row per worker (views into the master's receive buffers are fine)
+'''
+import numpy as np
+
+
+def pairwise_sq_distances(mats):
+    '''
+    (n, n) squared euclidean distances between workers, `mats` is a list of (n, d_l) blocks
+    (one per layer, or a single one for the whole model). ||g_i-g_j||^2 = |g_i|^2+|g_j|^2-2<g_i, g_j>
+    so every block only costs one Gram matrix (a single BLAS call), no difference vectors
+    '''
+    n = mats[0].shape[0]
+    gram = np.zeros((n, n), dtype=np.float64)
+    for mat in mats:
+        gram += np.dot(mat, mat.T)
+    sq_norms = np.diag(gram).copy()
+    distances = sq_norms[:, None] + sq_norms[None, :] - 2*gram
+    # cancellation can leave tiny negative values
+    np.maximum(distances, 0, out=distances)
+    return distances
+
+
+def krum_scores(mats, s):
+    '''
+    Krum score of every worker, the sum of squared distances to its n-s-2 closest neighbors
+    Method introduced by: https://arxiv.org/abs/1703.02757
+    '''
+    distances = pairwise_sq_distances(mats)
+    n = distances.shape[0]
+    num_neighbors = n-s-2
+    assert num_neighbors > 0, "Krum needs n > s+2, got n={} s={}".format(n, s)
+    np.fill_diagonal(distances, np.inf)
+    closest = np.partition(distances, num_neighbors-1, axis=1)[:, :num_neighbors]
+    return closest.sum(axis=1)
+
+
+def krum_select(mats, s, m=1):
+    '''indices of the `m` workers with the lowest Krum scores (`m=1` is Krum, `m>1` Multi-Krum)'''
+    scores = krum_scores(mats, s)
+    return np.argsort(scores, kind='mergesort')[:m]
+
+
+def weiszfeld(mats, init=None, tol=1e-6, max_iter=200, eps=1e-8):
+    '''
+    geometric median of the workers (rows of the horizontally concatenated blocks `mats`) with
+    Weiszfeld iterations. Distances come from |g_i|^2-2<g_i, z>+|z|^2, so an iteration costs two
+    GEMVs per block and never materializes a (n, d) difference. `init` (e.g. last step's median,
+    one vector per block) warm starts the solver, otherwise it starts at the mean. Stops early once
+    the estimate moves by less than `tol` relative to its norm
+    returns (one median vector per block, iterations used)
+    '''
+    n = mats[0].shape[0]
+    sq_norms = np.zeros(n, dtype=np.float64)
+    for mat in mats:
+        sq_norms += np.einsum('ij,ij->i', mat, mat)
+    if init is None:
+        median = [mat.mean(axis=0) for mat in mats]
+    else:
+        median = [np.asarray(m, dtype=mat.dtype).reshape(mat.shape[1]) for m, mat in zip(init, mats)]
+    iterations = 0
+    while iterations < max_iter:
+        iterations += 1
+        dots = np.zeros(n, dtype=np.float64)
+        median_sq_norm = 0.0
+        for mat, m in zip(mats, median):
+            dots += np.dot(mat, m)
+            median_sq_norm += float(np.dot(m, m))
+        distances = np.sqrt(np.maximum(sq_norms-2*dots+median_sq_norm, 0))
+        weights = 1.0/np.maximum(distances, eps)
+        weights /= weights.sum()
+        new_median = [np.dot(weights.astype(mat.dtype), mat) for mat in mats]
+        step = np.sqrt(sum(float(np.sum(np.square(new_m-m))) for new_m, m in zip(new_median, median)))
+        median = new_median
+        if step <= tol*max(np.sqrt(median_sq_norm), eps):
+            break
+    return median, iterations
+
+
+def _column_chunks(d, chunk_size):
+    return [(start, min(start+chunk_size, d)) for start in range(0, d, chunk_size)]
+
+
+def _chunked(reduce_chunk, mat, chunk_size, pool):
+    '''
+    apply `reduce_chunk` to fixed-size column chunks of the (n, d) matrix `mat`, so that at most a
+    (n, chunk_size) copy per thread is alive, the chunks are independent and run on `pool` if given
+    '''
+    d = mat.shape[1]
+    out = np.empty(d, dtype=mat.dtype)
+    def _run(chunk):
+        start, end = chunk
+        out[start:end] = reduce_chunk(mat[:, start:end])
+    chunks = _column_chunks(d, chunk_size)
+    if pool is None or len(chunks) == 1:
+        for chunk in chunks:
+            _run(chunk)
+    else:
+        # numpy releases the GIL in `partition`, so threads scale over chunks
+        pool.map(_run, chunks)
+    return out
+
+
+def coordinate_median(mat, chunk_size=65536, pool=None):
+    '''coordinate-wise median over the workers (rows) of the (n, d) matrix `mat`'''
+    n = mat.shape[0]
+    if n % 2 == 1:
+        return _chunked(lambda block: np.partition(block, n//2, axis=0)[n//2], mat, chunk_size, pool)
+    def _even_median(block):
+        part = np.partition(block, [n//2-1, n//2], axis=0)
+        return 0.5*(part[n//2-1]+part[n//2])
+    return _chunked(_even_median, mat, chunk_size, pool)
+
+
+def trimmed_mean(mat, beta, chunk_size=65536, pool=None):
+    '''
+    coordinate-wise beta-trimmed mean, the floor(beta*n) largest and smallest values of every
+    coordinate are dropped before averaging over the workers (rows) of `mat`
+    '''
+    n = mat.shape[0]
+    trim = int(beta*n)
+    assert 0 <= trim and 2*trim < n, "can not trim {} workers from each side of {}".format(trim, n)
+    if trim == 0:
+        return _chunked(lambda block: block.mean(axis=0), mat, chunk_size, pool)
+    def _trimmed(block):
+        part = np.partition(block, [trim, n-trim-1], axis=0)
+        return part[trim:n-trim].mean(axis=0)
+    return _chunked(_trimmed, mat, chunk_size, pool)
@@ -1,6 +1,7 @@
 import random
 
 import numpy as np
+from mpi4py import MPI
 from torchvision import datasets, transforms
 
 from model_ops.lenet import LeNet, LeNetSplit
@@ -11,6 +12,7 @@ from model_ops.fc_nn import FC_NN, FC_NN_Split
 from model_ops.utils import err_simulation
 
 from coding import search_w
+from datasets.tensor_data import load_tensor_dataset, TensorBatchLoader
 from master import baseline_master, rep_master, cyclic_master
 from worker import baseline_worker, rep_worker, cyclic_worker
 
@@ -27,6 +29,10 @@ def load_data(dataset, seed, args):
         torch.manual_seed(seed)
         random.seed(seed)
     if dataset == "MNIST":
+        if args.data_backend == "tensor":
+            training_set = load_tensor_dataset(dataset, './mnist_data', train=True, comm=MPI.COMM_WORLD if args.shared_dataset else None)
+            train_loader = TensorBatchLoader(training_set, batch_size=args.batch_size, shuffle=True, seed=seed)
+            return train_loader, training_set, None
         training_set = datasets.MNIST('./mnist_data', train=True, download=True,
                    transform=transforms.Compose([
                        transforms.ToTensor(),
@@ -55,10 +61,15 @@ def load_data(dataset, seed, args):
             transforms.ToTensor(),
             normalize])
         # load training and test set here:
-        training_set = datasets.CIFAR10(root='./cifar10_data', train=True,
-                                                download=True, transform=transform_train)
-        train_loader = torch.utils.data.DataLoader(training_set, batch_size=args.batch_size,
-                                                  shuffle=True)
+        if args.data_backend == "tensor":
+            # raw images in memory, padding, crop, flip and normalization run on whole batches
+            training_set = load_tensor_dataset(dataset, './cifar10_data', train=True, comm=MPI.COMM_WORLD if args.shared_dataset else None)
+            train_loader = TensorBatchLoader(training_set, batch_size=args.batch_size, shuffle=True, seed=seed)
+        else:
+            training_set = datasets.CIFAR10(root='./cifar10_data', train=True,
+                                                    download=True, transform=transform_train)
+            train_loader = torch.utils.data.DataLoader(training_set, batch_size=args.batch_size,
+                                                      shuffle=True)
         testset = datasets.CIFAR10(root='./cifar10_data', train=False,
                                                download=True, transform=transform_test)
         test_loader = torch.utils.data.DataLoader(testset, batch_size=args.test_batch_size,
@@ -66,6 +77,11 @@ def load_data(dataset, seed, args):
     return train_loader, training_set, test_loader
 
 
+def persistent_bcast_supported():
+    # persistent collectives (`Bcast_init`) only came with MPI-4
+    return hasattr(MPI.Comm, 'Bcast_init') and MPI.Get_version()[0] >= 4
+
+
 def group_assign(world_size, group_size, rank):
     if world_size % group_size == 0:
         ret_group_dict, group_list = _assign(world_size, group_size, rank)  
@@ -121,6 +137,18 @@ def prepare(args, rank, world_size):
                     'train_dir':args.train_dir, 
                     'update_mode':args.mode, 
                     'compress_grad':args.compress_grad, 
+                    'bucket_grad':args.bucket_grad, 
+                    'bucket_cap_mb':args.bucket_cap_mb, 
+                    'persistent_comm':args.persistent_comm, 
+                    'wire_dtype':args.wire_dtype, 
+                    'compress_threads':args.compress_threads, 
+                    'aggregate_scope':args.aggregate_scope, 
+                    'multi_krum_m':args.multi_krum_m, 
+                    'geo_median_tol':args.geo_median_tol, 
+                    'geo_median_max_iter':args.geo_median_max_iter, 
+                    'trim_beta':args.trim_beta, 
+                    'aggregate_chunk_size':args.aggregate_chunk_size, 
+                    'aggregate_threads':args.aggregate_threads, 
                     'checkpoint_step':args.checkpoint_step
                     }
         kwargs_worker = {
@@ -135,10 +163,24 @@ def prepare(args, rank, world_size):
                     'worker_fail':args.worker_fail,
                     'err_mode':args.err_mode, 
                     'compress_grad':args.compress_grad, 
+                    'bucket_grad':args.bucket_grad, 
+                    'bucket_cap_mb':args.bucket_cap_mb, 
+                    'persistent_comm':args.persistent_comm, 
+                    'wire_dtype':args.wire_dtype, 
+                    'compressor':args.compressor, 
+                    'compress_level':args.compress_level, 
+                    'compress_shuffle':args.compress_shuffle, 
+                    'compress_typesize':args.compress_typesize, 
+                    'compress_threads':args.compress_threads, 
+                    'compress_target_mbps':args.compress_target_mbps, 
                     'eval_freq':args.eval_freq, 
                     'train_dir':args.train_dir, 
                     'checkpoint_step':args.checkpoint_step,
-                    'adversaries':adversaries
+                    'adversaries':adversaries,
+                    'wait_policy':args.wait_policy,
+                    'wait_max_sleep':args.wait_max_sleep,
+                    'zero_copy_model':args.zero_copy_model,
+                    'stream_grad':args.stream_grad
                     }
     # majority vote
     elif args.approach == "maj_vote":
@@ -158,6 +200,11 @@ def prepare(args, rank, world_size):
                     'group_list':group_list, 
                     'update_mode':args.mode, 
                     'compress_grad':args.compress_grad, 
+                    'bucket_grad':args.bucket_grad, 
+                    'bucket_cap_mb':args.bucket_cap_mb, 
+                    'persistent_comm':args.persistent_comm, 
+                    'wire_dtype':args.wire_dtype, 
+                    'compress_threads':args.compress_threads, 
                     'checkpoint_step':args.checkpoint_step
                     }
         kwargs_worker = {
@@ -175,14 +222,33 @@ def prepare(args, rank, world_size):
                     'group_seeds':group_seeds, 
                     'group_num':group_num,
                     'compress_grad':args.compress_grad, 
+                    'bucket_grad':args.bucket_grad, 
+                    'bucket_cap_mb':args.bucket_cap_mb, 
+                    'persistent_comm':args.persistent_comm, 
+                    'wire_dtype':args.wire_dtype, 
+                    'compressor':args.compressor, 
+                    'compress_level':args.compress_level, 
+                    'compress_shuffle':args.compress_shuffle, 
+                    'compress_typesize':args.compress_typesize, 
+                    'compress_threads':args.compress_threads, 
+                    'compress_target_mbps':args.compress_target_mbps, 
                     'eval_freq':args.eval_freq, 
                     'train_dir':args.train_dir,
-                    'adversaries':adversaries
+                    'adversaries':adversaries,
+                    'wait_policy':args.wait_policy,
+                    'wait_max_sleep':args.wait_max_sleep,
+                    'zero_copy_model':args.zero_copy_model,
+                    'stream_grad':args.stream_grad
                     }
     # cyclic code
     elif args.approach == "cyclic":
         adversaries = _generate_adversarial_nodes(args, world_size)
-        W, fake_W, W_perp, S, C_1 = search_w(world_size-1, args.worker_fail)
+        # the coding matrices only depend on (n, s): rank 0 builds (or loads) them once and shares them
+        if rank == 0:
+            coding_matrices = search_w(world_size-1, args.worker_fail, cache_dir=args.coding_cache_dir, real=args.real_code)
+        else:
+            coding_matrices = None
+        W, fake_W, W_perp, S, C_1 = MPI.COMM_WORLD.bcast(coding_matrices, root=0)
         train_loader, training_set, test_loader = load_data(dataset=args.dataset, seed=SEED_, args=args)
         # for debug print
         #np.set_printoptions(precision=4,linewidth=200.0)
@@ -197,9 +263,18 @@ def prepare(args, rank, world_size):
                     'eval_freq':args.eval_freq, 
                     'train_dir':args.train_dir, 
                     'compress_grad':args.compress_grad, 
+                    'bucket_grad':args.bucket_grad, 
+                    'bucket_cap_mb':args.bucket_cap_mb, 
+                    'persistent_comm':args.persistent_comm, 
+                    'wire_dtype':args.wire_dtype, 
+                    'compress_threads':args.compress_threads, 
                     'W_perp':W_perp, 'W':W, 
                     'worker_fail':args.worker_fail,
-                    'decoding_S':S, 'C_1':C_1
+                    'decoding_S':S, 'C_1':C_1,
+                    'syndrome_tol':args.syndrome_tol,
+                    'real_code':args.real_code,
+                    'recover_cache_size':args.recover_cache_size,
+                    'aggregate_scope':args.aggregate_scope
                     }
         kwargs_worker = {
                     'batch_size':args.batch_size, 
@@ -213,12 +288,29 @@ def prepare(args, rank, world_size):
                     'worker_fail':args.worker_fail, 
                     'err_mode':args.err_mode, 
                     'compress_grad':args.compress_grad,
+                    'bucket_grad':args.bucket_grad, 
+                    'bucket_cap_mb':args.bucket_cap_mb, 
+                    'persistent_comm':args.persistent_comm, 
+                    'wire_dtype':args.wire_dtype, 
+                    'compressor':args.compressor, 
+                    'compress_level':args.compress_level, 
+                    'compress_shuffle':args.compress_shuffle, 
+                    'compress_typesize':args.compress_typesize, 
+                    'compress_threads':args.compress_threads, 
+                    'compress_target_mbps':args.compress_target_mbps, 
                     'encoding_matrix':W, 
+                    'real_code':args.real_code,
+                    'encode_mode':args.encode_mode,
+                    'loader_workers':args.loader_workers,
                     'seed':SEED_, 
                     'fake_W':fake_W, 
                     'eval_freq':args.eval_freq, 
                     'train_dir':args.train_dir,
-                    'adversaries':adversaries
+                    'adversaries':adversaries,
+                    'wait_policy':args.wait_policy,
+                    'wait_max_sleep':args.wait_max_sleep,
+                    'zero_copy_model':args.zero_copy_model,
+                    'stream_grad':args.stream_grad
                     }
     datum = (train_loader, training_set, test_loader)
     return datum, kwargs_master, kwargs_worker
\ No newline at end of file
@@ -0,0 +1,57 @@
+import numpy as np
+from mpi4py import MPI
+
+WIRE_DTYPES_ = ('float64', 'float32', 'float16', 'bfloat16')
+
+# float16 and bfloat16 have no MPI datatype, both travel as 16-bit unsigned integers
+_NUMPY_TYPES = {'float64': np.float64, 'float32': np.float32, 'float16': np.float16, 'bfloat16': np.uint16}
+_MPI_TYPES = {'float64': MPI.DOUBLE, 'float32': MPI.FLOAT, 'float16': MPI.UNSIGNED_SHORT, 'bfloat16': MPI.UNSIGNED_SHORT}
+
+class WireFormat(object):
+    def __init__(self, name='float64'):
+        """
+        dtype that weights and gradients travel in between master and workers. Models train in
+        float32, so every format but `float64` is computed in float32 on both ends. bfloat16 is
+        stored as the upper half of a float32 (rounded to nearest even) in a uint16 array
+        """
+        assert name in WIRE_DTYPES_, "wire dtype should be one of {}".format(WIRE_DTYPES_)
+        self.name = name
+        self.dtype = np.dtype(_NUMPY_TYPES[name])
+        self.mpi_type = _MPI_TYPES[name]
+        self.compute_dtype = np.dtype(np.float64) if name == 'float64' else np.dtype(np.float32)
+
+    @property
+    def needs_decode(self):
+        '''whether wire buffers have to be decoded before doing math on them'''
+        return self.dtype != self.compute_dtype
+
+    def encode(self, src, out):
+        '''write `src` (float32/float64) into the preallocated wire buffer `out`'''
+        if self.name == 'bfloat16':
+            bits = np.ascontiguousarray(src, dtype=np.float32).view(np.uint32)
+            # round to nearest even on the 16 bits we drop
+            rounded = bits + (0x7FFF + ((bits >> 16) & 1)).astype(np.uint32)
+            np.right_shift(rounded, 16, out=out, casting='unsafe')
+        else:
+            out[...] = src
+        return out
+
+    def decode(self, src, out):
+        '''write the wire buffer `src` into the preallocated compute buffer `out`'''
+        if self.name == 'bfloat16':
+            np.left_shift(src, 16, out=out.view(np.uint32), dtype=np.uint32)
+        else:
+            out[...] = src
+        return out
+
+    def cast(self, src):
+        '''wire version of `src`, only allocates when a conversion is needed'''
+        if src.dtype == self.dtype and self.name != 'bfloat16':
+            return src
+        return self.encode(src, np.empty(src.shape, dtype=self.dtype))
+
+    def to_compute(self, src):
+        '''compute version of the wire array `src`, only allocates when a conversion is needed'''
+        if src.dtype == self.compute_dtype:
+            return src
+        return self.decode(src, np.empty(src.shape, dtype=self.compute_dtype))
@@ -21,6 +21,29 @@ class DistributedWorker(NN_Trainer):
         self._train_dir = kwargs['train_dir']
         self._checkpoint_step = kwargs['checkpoint_step']
         self._max_steps = kwargs['max_steps']
+        self._bucket_grad = kwargs['bucket_grad']
+        self._bucket_cap_mb = kwargs['bucket_cap_mb']
+        # persistent requests need raw (uncompressed or bucketed) send buffers
+        self._persistent_comm = kwargs['persistent_comm'] and (self._compress_grad == 'None' or self._bucket_grad)
+        self._grad_sender = None
+        self._bucket_requests = None
+        # buckets are sent from autograd hooks while backward runs, replaces the manual backward of split models
+        self._stream_grad = kwargs['stream_grad'] and self._bucket_grad
+        self._grad_streamer = None
+        # dtype weights and gradients travel in
+        self._wire = WireFormat(kwargs['wire_dtype'])
+        # codec behind every compressed gradient sent by this worker
+        self._compressor = init_compressor(kwargs)
+        # how this worker waits for the next step while master aggregates
+        self._step_notifier = StepNotifier(comm, policy=kwargs['wait_policy'], max_sleep=kwargs['wait_max_sleep'])
+        # step and weights in one message with comm-type Packet, `_model_version` is the version loaded into the model
+        self._model_packet = None
+        self._model_version = -1
+        # broadcast of the next packet posted ahead of time and when it was posted
+        self._packet_request = None
+        self._packet_posted = 0
+        # parameters alias the float32 weights of the packet, only with comm-type Packet and wire-dtype float32
+        self._zero_copy_model = kwargs['zero_copy_model'] and self.comm_type == "Packet" and self._wire.name == 'float32'
 
         # only for test      
         #self._fail_workers = [self.world_size-i for i in range(1, kwargs['worker_fail']+1)]
@@ -34,15 +57,15 @@ class DistributedWorker(NN_Trainer):
         if self.network_config == "LeNet":
             self.network=LeNet()
         elif self.network_config == "ResNet18":
-            self.network=ResNetSplit18()
+            self.network=ResNet18() if self._stream_grad else ResNetSplit18()
         elif self.network_config == "ResNet34":
-            self.network=ResNetSplit34()
+            self.network=ResNet34() if self._stream_grad else ResNetSplit34()
         elif self.network_config == "ResNet50":
-            self.network=ResNetSplit50()
+            self.network=ResNet50() if self._stream_grad else ResNetSplit50()
         elif self.network_config == "ResNet101":
-            self.network=ResNetSplit101()
+            self.network=ResNet101() if self._stream_grad else ResNetSplit101()
         elif self.network_config == "ResNet152":
-            self.network=ResNetSplit152()
+            self.network=ResNet152() if self._stream_grad else ResNetSplit152()
         elif self.network_config == "FC":
             self.network=FC_NN()
         elif self.network_config == "VGG11":
@@ -61,7 +84,12 @@ class DistributedWorker(NN_Trainer):
         self.criterion = nn.CrossEntropyLoss()
         # assign a buffer for receiving models from parameter server
         self.init_recv_buf()
-        if "ResNet" in self.network_config:
+        self.init_bucket()
+        # plain ResNets have the same parameters (and state dict keys) as the split ones, autograd does the whole backward
+        self._split_backward = "ResNet" in self.network_config and not self._stream_grad
+        if self._stream_grad:
+            self._grad_streamer = GradientStreamer(self.comm, self.network, self._bucket, dest=0)
+        if self._split_backward:
             self._param_idx = self.network.fetch_init_channel_index-1
 
     def train(self, train_loader, test_loader):
@@ -110,6 +138,7 @@ class DistributedWorker(NN_Trainer):
                     iteration_last_step = time.time() - iter_start_time
                     iter_start_time = time.time()
                     first = False
+                    wait_duration = self._step_notifier.take_wait()
                     print("Rank of this node: {}, Current step: {}".format(self.rank, self.cur_step))
 
                     # TODO(hwang): return layer request here and do weight before the forward step begins, rather than implement
@@ -119,6 +148,8 @@ class DistributedWorker(NN_Trainer):
                         self.async_fetch_weights_bcast()
                     elif self.comm_type == "Async":
                         self.async_fetch_weights_async()
+                    elif self.comm_type == "Packet":
+                        self.apply_model_packet()
                     fetch_weight_duration = time.time() - fetch_weight_start_time
 
                     # switch to training mode
@@ -128,7 +159,7 @@ class DistributedWorker(NN_Trainer):
                     # forward step
                     forward_start_time = time.time()
                     logits = self.network(X_batch)
-                    if "ResNet" in self.network_config:
+                    if self._split_backward:
                         logits_1 = Variable(logits.data, requires_grad=True)
                         loss = self.criterion(logits_1, y_batch)
                     else:
@@ -138,16 +169,18 @@ class DistributedWorker(NN_Trainer):
                     # TODO(hwang): figure out a better way to do this
                     computation_time = time.time() - forward_start_time
                     # backward step
-                    if "ResNet" in self.network_config:
+                    if self._split_backward:
                         self._backward(loss, logits_1)
                     else:
                         computation_time, c_duration = self._backward(loss, computation_time=computation_time)
-                    
+                    # the next model packet arrives while the next batch is loaded
+                    self.post_model_packet()
+
                     # on the end of a certain iteration
                     prec1, prec5 = accuracy(logits.data, train_label_batch.long(), topk=(1, 5))
-                    print('Worker: {}, Step: {}, Epoch: {} [{}/{} ({:.0f}%)], Loss: {:.4f}, Time Cost: {:.4f}, Comp: {:.4f}, Comm: {:.4f}, Prec@1: {}, Prec@5: {}'.format(self.rank,
+                    print('Worker: {}, Step: {}, Epoch: {} [{}/{} ({:.0f}%)], Loss: {:.4f}, Time Cost: {:.4f}, Comp: {:.4f}, Comm: {:.4f}, Wait: {:.4f}, Prec@1: {}, Prec@5: {}'.format(self.rank,
                          self.cur_step, num_epoch, batch_idx * self.batch_size, len(train_loader.dataset), 
-                            (100. * (batch_idx * self.batch_size) / len(train_loader.dataset)), loss.data[0], time.time()-iter_start_time, computation_time, c_duration+fetch_weight_duration, prec1.numpy()[0], prec5.numpy()[0]))
+                            (100. * (batch_idx * self.batch_size) / len(train_loader.dataset)), loss.data[0], time.time()-iter_start_time, computation_time, c_duration+fetch_weight_duration, wait_duration, prec1.numpy()[0], prec5.numpy()[0]))
                     # break here to fetch data then enter fetching step loop again
                     if self.cur_step%self._eval_freq == 0 and self.rank==1:
                         if "ResNet" in self.network_config:
@@ -158,49 +191,161 @@ class DistributedWorker(NN_Trainer):
                     break
 
     def init_recv_buf(self):
-        self.model_recv_buf = ModelBuffer(self.network)
+        self.model_recv_buf = ModelBuffer(self.network, wire=self._wire)
+
+    def init_bucket(self, dtype=None):
+        '''flat send buffer for the bucketed gradient protocol, laid out the same way as on master (in the wire dtype unless `dtype` is given)'''
+        self._bucket = None
+        if self._bucket_grad:
+            wire = self._wire if dtype is None else None
+            self._bucket = GradientBucket([p.size() for p in self.network.parameters()], dtype=dtype, cap_mb=self._bucket_cap_mb, wire=wire)
+
+    def _send_bucket(self, grads, cyclic=False):
+        '''pack gradients (in model parameter order) into the flat buffer and send all buckets at once'''
+        if self.rank in self._fail_workers[self.cur_step]:
+            # simulate before packing, the flat buffer may hold encoded 16-bit values
+            grads = [err_simulation(g, self._err_mode, cyclic=cyclic) for g in grads]
+        self._bucket.pack(grads)
+        if self._persistent_comm:
+            if self._bucket_requests is None:
+                self._bucket_requests = self._bucket.isend(self.comm, dest=0, persistent=True)
+            MPI.Prequest.Startall(self._bucket_requests)
+            MPI.Request.Waitall(self._bucket_requests)
+            return
+        req_send_check = self._bucket.isend(self.comm, dest=0)
+        MPI.Request.Waitall(req_send_check)
+
+    def _send_grads_persistent(self, grads):
+        '''per-layer raw gradients (in model parameter order) through persistent sends'''
+        if self._grad_sender is None:
+            self._grad_sender = GradientSendBuffer(self.comm, [g.shape for g in grads], dest=0, wire=self._wire)
+        if self.rank in self._fail_workers[self.cur_step]:
+            grads = [err_simulation(g, self._err_mode) for g in grads]
+        self._grad_sender.send(grads)
 
     def sync_fetch_step(self):
         '''fetch the first step from the parameter server'''
         self.next_step = self.comm.recv(source=0, tag=10)
 
     def async_fetch_step(self):
-        req = self.comm.irecv(source=0, tag=10)
-        self.next_step = req.wait()
+        '''wait for the next step message (or model packet) with the configured wait policy'''
+        if self.comm_type == "Packet":
+            self.next_step = self._fetch_model_packet()
+            return
+        self.next_step = self._step_notifier.fetch()
+
+    def post_model_packet(self):
+        '''
+        post the nonblocking broadcast of the next model packet (comm-type Packet only), it is completed
+        by the next `async_fetch_step`. Nothing is posted after the last step, master sends no more packets
+        '''
+        if self.comm_type != "Packet" or self.cur_step >= self._max_steps:
+            return
+        if self._zero_copy_model and self.cur_step%self._eval_freq == 0 and self.rank==1:
+            # the weights of this step are still read by the evaluation, MPI must not write into them yet
+            return
+        self._start_model_packet()
+
+    def _init_model_packet(self):
+        '''
+        allocate the model packet, with `zero_copy_model` the parameters become views of its weights
+        so receiving a packet already is the whole model update
+        '''
+        params = list(self.network.parameters())
+        self._model_packet = ModelPacket([param.size() for param in params], self._wire)
+        if self._zero_copy_model:
+            for layer, param in zip(self._model_packet.layers, params):
+                layer[...] = param.data.numpy()
+                param.data = torch.from_numpy(layer)
+
+    def _start_model_packet(self):
+        if self._packet_request is not None:
+            return
+        if self._model_packet is None:
+            self._init_model_packet()
+        self._packet_request = self._model_packet.ibcast(self.comm)
+        self._packet_posted = time.time()
+
+    def _fetch_model_packet(self):
+        '''complete the broadcast of the next model packet (posting it first if needed), returns its step'''
+        self._start_model_packet()
+        # the batch of the step is loaded by now
+        batch_ready = time.time()
+        arrived_early = self._packet_request.Test()
+        self._step_notifier.wait(self._packet_request)
+        self._packet_request = None
+        packet_done = time.time()
+        loading = batch_ready-self._packet_posted
+        if arrived_early:
+            # the broadcast finished at some point during loading, only bounded by the loading time
+            hidden = "<={:.4f}".format(loading)
+        else:
+            # the broadcast was in flight during all of loading
+            hidden = "{:.4f}".format(loading)
+        print("Worker: {}, Step: {}, Packet Timeline: Posted: +0.0000, Batch Ready: +{:.4f}, Done: +{:.4f}, Hidden Fetch: {}, Exposed Fetch: {:.4f}".format(self.rank,
+            self._model_packet.step, loading, packet_done-self._packet_posted, hidden, packet_done-batch_ready))
+        return self._model_packet.step
+
+    def apply_model_packet(self):
+        '''load the weights of the last received packet unless the model already has their version'''
+        if self._model_packet.version <= self._model_version:
+            return
+        if not self._zero_copy_model:
+            self.model_update(self._model_packet.unpack())
+        self._model_version = self._model_packet.version
 
     def async_fetch_weights_async(self):
+        if self._persistent_comm:
+            self._persistent_fetch_weights(comm_type="Async")
+            return
         request_layers = []
         layers_to_update = []
         for layer_idx, layer in enumerate(self.model_recv_buf.recv_buf):
             if self.model_recv_buf.layer_cur_step[layer_idx] < self.cur_step:
                 layers_to_update.append(layer_idx)
-                req = self.comm.Irecv([self.model_recv_buf.recv_buf[layer_idx], MPI.DOUBLE], source=0, tag=11+layer_idx)
+                req = self.comm.Irecv([self.model_recv_buf.recv_buf[layer_idx], self._wire.mpi_type], source=0, tag=11+layer_idx)
                 request_layers.append(req)
 
         assert (len(layers_to_update) == len(request_layers))
         weights_to_update = []
         for req_idx, req_l in enumerate(request_layers):
             req_l.wait()
-            weights = self.model_recv_buf.recv_buf[req_idx]
+            weights = self.model_recv_buf.decode(req_idx)
             weights_to_update.append(weights)
             # we also need to update the layer cur step here:
             self.model_recv_buf.layer_cur_step[req_idx] = self.cur_step
         self.model_update(weights_to_update)
     
     def async_fetch_weights_bcast(self):
+        if self._persistent_comm:
+            self._persistent_fetch_weights(comm_type="Bcast")
+            return
         layers_to_update = []
         for layer_idx, layer in enumerate(self.model_recv_buf.recv_buf):
             if self.model_recv_buf.layer_cur_step[layer_idx] < self.cur_step:
                 layers_to_update.append(layer_idx)
-                self.comm.Bcast([self.model_recv_buf.recv_buf[layer_idx], MPI.DOUBLE], root=0)
+                self.comm.Bcast([self.model_recv_buf.recv_buf[layer_idx], self._wire.mpi_type], root=0)
         weights_to_update = []
         for req_idx, layer_idx in enumerate(layers_to_update):
-            weights = self.model_recv_buf.recv_buf[req_idx]
+            weights = self.model_recv_buf.decode(req_idx)
             weights_to_update.append(weights)
             # we also need to update the layer cur step here:
             self.model_recv_buf.layer_cur_step[req_idx] = self.cur_step
         self.model_update(weights_to_update)
     
+    def _persistent_fetch_weights(self, comm_type):
+        '''the weight buffers are bound once to persistent receives (or broadcasts with MPI-4), mirrors master'''
+        if self.model_recv_buf.recv_requests is None:
+            self.model_recv_buf.init_requests(self.comm, comm_type)
+        if len(self.model_recv_buf.recv_requests) == 0:
+            for buf in self.model_recv_buf.recv_buf:
+                self.comm.Bcast([buf, self._wire.mpi_type], root=0)
+        else:
+            MPI.Prequest.Startall(self.model_recv_buf.recv_requests)
+            MPI.Request.Waitall(self.model_recv_buf.recv_requests)
+        self.model_recv_buf.layer_cur_step = [self.cur_step]*len(self.model_recv_buf.layer_cur_step)
+        self.model_update([self.model_recv_buf.decode(layer_idx) for layer_idx in range(len(self.model_recv_buf.recv_buf))])
+
     def update_step(self):
         '''update local (global) step on worker'''
         changed = (self.cur_step != self.next_step)
@@ -223,30 +368,36 @@ class DistributedWorker(NN_Trainer):
         self.network.load_state_dict(new_state_dict)
 
     def _backward(self, loss, logits_1=None, computation_time=None):
+        if self._stream_grad:
+            return self._backward_streamed(loss, computation_time)
         b_start = time.time()
         loss.backward()
         b_duration = time.time() - b_start
-        if "ResNet" in self.network_config:
+        if "ResNet" in self.network_config and self._bucket_grad:
+            # finish the backward pass locally then ship the whole model in buckets
+            self.network.backward_single(logits_1.grad)
+            self._send_bucket([p.grad.data.numpy() for p in self.network.parameters()])
+        elif "ResNet" in self.network_config:
             req_send_check = []
             init_grad_data = logits_1.grad.data.numpy()
-            init_grad_data = np.sum(init_grad_data, axis=0).astype(np.float64)
+            init_grad_data = np.sum(init_grad_data, axis=0)
             # send grad to parameter server
             if self.rank in self._fail_workers:
                 # simulate some byzantine error here:
                 simulation_grad = err_simulation(grad=init_grad_data, mode=self._err_mode)
                 if self._compress_grad=='compress':
-                    _compressed_grad = compress(simulation_grad)
-                    req_isend = self.comm.isend(_compressed_grad, dest=0, tag=88+self._param_idx)
+                    _compressed_grad = compress(self._wire.cast(simulation_grad))
+                    req_isend = self.comm.Isend([_compressed_grad, MPI.BYTE], dest=0, tag=88+self._param_idx)
                 else:
-                    req_isend = self.comm.Isend([simulation_grad, MPI.DOUBLE], dest=0, tag=88+self._param_idx)
+                    req_isend = self.comm.Isend([self._wire.cast(simulation_grad), self._wire.mpi_type], dest=0, tag=88+self._param_idx)
             else:
                 if self._compress_grad=='compress':
-                    _compressed_grad = compress(init_grad_data)
-                    req_isend = self.comm.isend(_compressed_grad, dest=0, tag=88+self._param_idx)
+                    _compressed_grad = compress(self._wire.cast(init_grad_data))
+                    req_isend = self.comm.Isend([_compressed_grad, MPI.BYTE], dest=0, tag=88+self._param_idx)
                 else:
-                    req_isend = self.comm.Isend([init_grad_data, MPI.DOUBLE], dest=0, tag=88+self._param_idx)
+                    req_isend = self.comm.Isend([self._wire.cast(init_grad_data), self._wire.mpi_type], dest=0, tag=88+self._param_idx)
             req_send_check.append(req_isend)
-            req_send_check=self.network.backward_normal(logits_1.grad, self.comm, req_send_check, self.cur_step, self._fail_workers, self._err_mode, self._compress_grad)
+            req_send_check=self.network.backward_normal(logits_1.grad, self.comm, req_send_check, self.cur_step, self._fail_workers, self._err_mode, self._compress_grad, wire=self._wire)
             req_send_check[-1].wait()
         else:
             computation_time += b_duration
@@ -255,20 +406,40 @@ class DistributedWorker(NN_Trainer):
             c_duration = time.time() - c_start
             return computation_time, c_duration
 
+    def _backward_streamed(self, loss, computation_time):
+        '''backward with the gradient buckets sent from hooks on the way, only the sends still in flight are waited for'''
+        err_fn = None
+        if self.rank in self._fail_workers[self.cur_step]:
+            err_fn = lambda grad: err_simulation(grad, self._err_mode)
+        self._grad_streamer.start(err_fn=err_fn)
+        b_start = time.time()
+        loss.backward()
+        computation_time += time.time() - b_start
+        c_start = time.time()
+        self._grad_streamer.finish()
+        c_duration = time.time() - c_start
+        return computation_time, c_duration
+
     def _send_grads(self):
+        if self._bucket_grad:
+            self._send_bucket([p.grad.data.numpy() for p in self.network.parameters()])
+            return
+        if self._persistent_comm:
+            self._send_grads_persistent([p.grad.data.numpy() for p in self.network.parameters()])
+            return
         req_send_check = []
         for param_index, param in enumerate(self.network.parameters()):
-            grad = param.grad.data.numpy().astype(np.float64)
+            grad = param.grad.data.numpy()
             if len(req_send_check) != 0:
                 req_send_check[-1].wait()
             if self.rank in self._fail_workers[self.cur_step]:
                 simulation_grad = err_simulation(grad, self._err_mode)
-                _compressed_grad = compress(simulation_grad)
-                req_isend = self.comm.isend(_compressed_grad, dest=0, tag=88+param_index)
+                _compressed_grad = compress(self._wire.cast(simulation_grad))
+                req_isend = self.comm.Isend([_compressed_grad, MPI.BYTE], dest=0, tag=88+param_index)
                 req_send_check.append(req_isend)
             else:
-                _compressed_grad = compress(grad)
-                req_isend = self.comm.isend(_compressed_grad, dest=0, tag=88+param_index)
+                _compressed_grad = compress(self._wire.cast(grad))
+                req_isend = self.comm.Isend([_compressed_grad, MPI.BYTE], dest=0, tag=88+param_index)
                 req_send_check.append(req_isend)
         req_send_check[-1].wait()
 
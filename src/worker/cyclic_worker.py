@@ -23,6 +23,14 @@ class CyclicWorker(DistributedWorker):
         self._compress_grad = kwargs['compress_grad']
         self._W = kwargs['encoding_matrix']
         self._fake_W = kwargs['fake_W']
+        # real valued (DCT) code: coded gradients are sent as float32 instead of complex64
+        self._real_code = kwargs['real_code']
+        self._coded_dtype = np.float32 if self._real_code else np.complex64
+        self._coded_mpi_type = MPI.FLOAT if self._real_code else MPI.C_FLOAT_COMPLEX
+        # per_batch: one backward pass per local batch, then encode; weighted_loss: backward the coded loss directly
+        self._encode_mode = kwargs['encode_mode']
+        # processes prefetching the local batches of the next steps
+        self._loader_workers = kwargs['loader_workers']
         self._seed = kwargs['seed']
         self._num_fail = kwargs['worker_fail']
         self._eval_freq = kwargs['eval_freq']
@@ -30,6 +38,26 @@ class CyclicWorker(DistributedWorker):
         self._err_mode = kwargs['err_mode']
         self._max_steps = kwargs['max_steps']
         self._fail_workers = kwargs['adversaries']
+        self._bucket_grad = kwargs['bucket_grad']
+        self._bucket_cap_mb = kwargs['bucket_cap_mb']
+        # coded gradients are only sent as raw buffers in bucketed mode
+        self._persistent_comm = kwargs['persistent_comm'] and self._bucket_grad
+        self._grad_sender = None
+        self._bucket_requests = None
+        # dtype weights and gradients travel in
+        self._wire = WireFormat(kwargs['wire_dtype'])
+        # codec behind every compressed gradient sent by this worker
+        self._compressor = init_compressor(kwargs)
+        # how this worker waits for the next step while master aggregates
+        self._step_notifier = StepNotifier(comm, policy=kwargs['wait_policy'], max_sleep=kwargs['wait_max_sleep'])
+        # step and weights in one message with comm-type Packet, `_model_version` is the version loaded into the model
+        self._model_packet = None
+        self._model_version = -1
+        # broadcast of the next packet posted ahead of time and when it was posted
+        self._packet_request = None
+        self._packet_posted = 0
+        # parameters alias the float32 weights of the packet, only with comm-type Packet and wire-dtype float32
+        self._zero_copy_model = kwargs['zero_copy_model'] and self.comm_type == "Packet" and self._wire.name == 'float32'
 
         # only for test
         # this one is going to be used to avoid fetch the weights for multiple times randomly generate fail worker index
@@ -59,6 +87,28 @@ class CyclicWorker(DistributedWorker):
         self.criterion = nn.CrossEntropyLoss()
         # assign a buffer for receiving models from parameter server
         self.init_recv_buf()
+        self.init_bucket(dtype=self._coded_dtype)
+        self.init_encode_buffers()
+
+    def init_encode_buffers(self):
+        '''
+        flattened gradients of every local batch as rows of one (hat_s, D) float32 matrix, and the
+        coded gradients of the whole model in one flat buffer that the per-layer sends slice
+        '''
+        self._param_shapes = [p.size() for p in self.network.parameters()]
+        self._param_offsets = [0]
+        for shape in self._param_shapes:
+            self._param_offsets.append(self._param_offsets[-1]+reduce(lambda x, y: x * y, shape))
+        self._local_grads = np.zeros((self._hat_s, self._param_offsets[-1]), dtype=np.float32)
+        self._coded_buf = np.zeros(self._param_offsets[-1], dtype=self._coded_dtype)
+        # real and imaginary parts of this worker's nonzero coefficients as columns, so that
+        # local_grads^T coefs writes the interleaved complex64 (or float32) coded gradients in place
+        coefs = self._W[self.rank-1][np.where(self._fake_W[self.rank-1]!=0)[0][0:self._hat_s]]
+        if self._real_code:
+            self._coef_matrix = np.real(coefs).astype(np.float32).reshape(self._hat_s, 1)
+        else:
+            self._coef_matrix = np.stack([np.real(coefs), np.imag(coefs)], axis=1).astype(np.float32)
+        self._coded_view = self._coded_buf.view(np.float32).reshape(self._param_offsets[-1], self._coef_matrix.shape[1])
 
     def train(self, training_set, test_loader):
         # the first step we need to do here is to sync fetch the inital worl_step from the parameter server
@@ -81,20 +131,23 @@ class CyclicWorker(DistributedWorker):
         # use following flags to achieve letting each worker compute more batches
         should_enter_next = False
 
+        # only the local batches of this worker are loaded, concatenated in the order of its row of W
+        local_batch_indices = np.where(self._fake_W[self.rank-1]!=0)[0][0:self._hat_s]
+        train_loader = cyclic_batch_loader(training_set, self.batch_size, self.num_workers, local_batch_indices,
+                                            loader_workers=self._loader_workers, seed=self._seed, num_epochs=self.max_epochs)
+        # one iterator for all epochs, the loader processes are only started once
+        train_batches = iter(train_loader)
+        steps_per_epoch = len(train_loader)//self.max_epochs
+
         print("Worker {}: starting training".format(self.rank))
         # start the training process
         for num_epoch in range(self.max_epochs):
             # after each epoch we need to make sure workers in the same group re-shuffling using the same seed
             torch.manual_seed(self._seed+(_FACTOR*num_epoch))
-            batch_bias = 0
             batch_idx = 0
-            while batch_bias <= len(training_set):
-                if batch_bias+self.batch_size*self.num_workers >= len(training_set):
-                    break
-                gloabl_image_batch, gloabl_label_batch = get_batch(training_set, np.arange(batch_bias, batch_bias+self.batch_size*self.num_workers))
-                batch_bias += self.batch_size*self.num_workers
+            for _ in range(steps_per_epoch):
+                local_image_batch, local_label_batch = next(train_batches)
                 batch_idx += 1
-                grad_collector = {}
                 _precision_counter = 0
                 # worker exit task
                 if self.cur_step == self._max_steps:
@@ -111,49 +164,55 @@ class CyclicWorker(DistributedWorker):
                     # the real start point of this iteration
                     iter_start_time = time.time()
                     first = False
+                    wait_duration = self._step_notifier.take_wait()
                     should_enter_next = False
                     print("Rank of this node: {}, Current step: {}".format(self.rank, self.cur_step))
                     # fetch weight
                     fetch_weight_start_time = time.time()
-                    self.async_fetch_weights_bcast()
+                    if self.comm_type == "Packet":
+                        self.apply_model_packet()
+                    else:
+                        self.async_fetch_weights_bcast()
                     fetch_weight_duration = time.time() - fetch_weight_start_time
                     # calculating on coded batches
                     comp_start = time.time()
-                    for b in range(self._hat_s):
-                        local_batch_indices = np.where(self._fake_W[self.rank-1]!=0)[0]
-                        _batch_bias = local_batch_indices[b]*self.batch_size
-                        train_image_batch = gloabl_image_batch[_batch_bias:_batch_bias+self.batch_size,:]
-                        train_label_batch = gloabl_label_batch[_batch_bias:_batch_bias+self.batch_size]
-
-                        X_batch, y_batch = Variable(train_image_batch), Variable(train_label_batch)
-                        self.network.train()
-                        self.optimizer.zero_grad()
-                        # forward step
-                        logits = self.network(X_batch)
-                        loss = self.criterion(logits, y_batch)
-
-                        # backward step
-                        backward_start_time = time.time()
-                        loss.backward()
-
-                        tempt_grads = []
-                        for p_i, p in enumerate(self.network.parameters()):
-                            tempt_grads.append(p.grad.data.numpy())
-                        grads = []
-                        for g_i, g in enumerate(reversed(tempt_grads)):
-                            grads.append(g)
-
-                        grad_collector[_batch_bias/self.batch_size] = grads
-                        _prec1, _ = accuracy(logits.data, train_label_batch.long(), topk=(1, 5))
-                        _precision_counter += _prec1.numpy()[0]
+                    coded_grads = None
+                    if self._encode_mode == "weighted_loss":
+                        coded_grads, logits, loss = self._weighted_loss_grads(local_image_batch, local_label_batch)
+                        for b in range(self._hat_s):
+                            _prec1, _ = accuracy(logits.data[b*self.batch_size:(b+1)*self.batch_size], local_label_batch[b*self.batch_size:(b+1)*self.batch_size].long(), topk=(1, 5))
+                            _precision_counter += _prec1.numpy()[0]
+                    else:
+                        for b in range(self._hat_s):
+                            train_image_batch = local_image_batch[b*self.batch_size:(b+1)*self.batch_size]
+                            train_label_batch = local_label_batch[b*self.batch_size:(b+1)*self.batch_size]
+
+                            X_batch, y_batch = Variable(train_image_batch), Variable(train_label_batch)
+                            self.network.train()
+                            self.optimizer.zero_grad()
+                            # forward step
+                            logits = self.network(X_batch)
+                            loss = self.criterion(logits, y_batch)
+
+                            # backward step
+                            backward_start_time = time.time()
+                            loss.backward()
+
+                            # copy out now, `zero_grad` of the next batch reuses the gradient memory
+                            for p_i, p in enumerate(self.network.parameters()):
+                                self._local_grads[b, self._param_offsets[p_i]:self._param_offsets[p_i+1]] = p.grad.data.numpy().reshape(-1)
+                            _prec1, _ = accuracy(logits.data, train_label_batch.long(), topk=(1, 5))
+                            _precision_counter += _prec1.numpy()[0]
                     comp_duration = time.time() - comp_start
                     # send linear combinations of gradients of multiple batches
                     encode_counter = 0
                     comm_counter = 0
-                    encode_cost, comm_cost=self._send_grads(grad_collector, encode_counter, comm_counter)
-                    print('Worker: {}, Step: {}, Epoch: {} [{}/{} ({:.0f}%)], Loss: {:.4f}, Time Cost: {:.4f}, Comp: {:.4f}, Comm: {:.4f}, Encode: {:.4f}, Prec@1: {}'.format(self.rank,
+                    encode_cost, comm_cost=self._send_grads(encode_counter, comm_counter, coded_grads=coded_grads)
+                    # the next model packet arrives while the next batch is loaded
+                    self.post_model_packet()
+                    print('Worker: {}, Step: {}, Epoch: {} [{}/{} ({:.0f}%)], Loss: {:.4f}, Time Cost: {:.4f}, Comp: {:.4f}, Comm: {:.4f}, Encode: {:.4f}, Wait: {:.4f}, Prec@1: {}'.format(self.rank,
                         self.cur_step, num_epoch, batch_idx * self.batch_size, len(training_set), 
-                        (100. * (batch_idx * self.batch_size) / len(training_set)), loss.data[0], time.time()-iter_start_time, comp_duration, comm_cost, encode_cost, _precision_counter/self._hat_s))
+                        (100. * (batch_idx * self.batch_size) / len(training_set)), loss.data[0], time.time()-iter_start_time, comp_duration, comm_cost, encode_cost, wait_duration, _precision_counter/self._hat_s))
                     if self.cur_step%self._eval_freq == 0 and self.rank==1:
                         if "ResNet" in self.network_config:
                             self._evaluate_model(test_loader)
@@ -162,33 +221,78 @@ class CyclicWorker(DistributedWorker):
                             pass
                     break
 
-    def _send_grads(self, grad_collector, encode_counter, comm_counter):
+    def _send_grads(self, encode_counter, comm_counter, coded_grads=None):
         '''
-        note that at here we're not sending anything about gradient but linear combination of gradients
+        note that at here we're not sending anything about gradient but linear combination of gradients,
+        `coded_grads` (in model parameter order) skips the encoding when they were computed already
         '''
         req_send_check = []
-        for i, param in enumerate(reversed(grad_collector[grad_collector.keys()[0]])):
+        if coded_grads is None:
             tmp_encode_start = time.time()
-            aggregated_grad = np.zeros(param.shape, dtype=complex)
-            # calculate combined gradients
-            for k, v in grad_collector.iteritems():
-                aggregated_grad = np.add(aggregated_grad, np.dot(self._W[self.rank-1][k], v[len(v)-i-1]))
+            coded_grads = self._encode_grads()
             encode_counter += (time.time() - tmp_encode_start)
+        if self._bucket_grad:
+            tmp_comm_start = time.time()
+            self._send_bucket(coded_grads, cyclic=True)
+            comm_counter += (time.time() - tmp_comm_start)
+            return encode_counter, comm_counter
+        for i, aggregated_grad in enumerate(coded_grads):
             tmp_comm_start = time.time()
             # send grad to master
             if len(req_send_check) != 0:
                 req_send_check[-1].wait()
             if self.rank in self._fail_workers[self.cur_step]:
-                simulation_grad = err_simulation(aggregated_grad, self._err_mode, cyclic=True)
-                _compressed_grad = compress(simulation_grad.astype(np.complex64))
-                req_isend = self.comm.isend(_compressed_grad, dest=0, tag=88+i)
-                req_send_check.append(req_isend)
+                aggregated_grad = err_simulation(aggregated_grad, self._err_mode, cyclic=True)
+            # master receives coded gradients into complex64 (float32 for the real code) buffers
+            coded_grad = np.ascontiguousarray(aggregated_grad, dtype=self._coded_dtype)
+            if self._compress_grad == 'compress':
+                _compressed_grad = compress(coded_grad)
+                req_isend = self.comm.Isend([_compressed_grad, MPI.BYTE], dest=0, tag=88+i)
             else:
-                _compressed_grad = compress(aggregated_grad.astype(np.complex64))
-                req_isend = self.comm.isend(_compressed_grad, dest=0, tag=88+i)
-                req_send_check.append(req_isend)
+                req_isend = self.comm.Isend([coded_grad, self._coded_mpi_type], dest=0, tag=88+i)
+            req_send_check.append(req_isend)
             comm_counter += (time.time() - tmp_comm_start)
         tmp_comm_start = time.time()
         req_send_check[-1].wait()
         comm_counter += time.time() - tmp_comm_start
-        return encode_counter, comm_counter
\ No newline at end of file
+        return encode_counter, comm_counter
+
+    def _weighted_loss_grads(self, train_image_batch, train_label_batch):
+        '''
+        coded gradients sum_k W[rank][k] g_k of all parameters without the per-batch gradients: the
+        encoding is linear, so its real (imaginary) part is the gradient of the sum of the batch losses
+        weighted with the real (imaginary) parts of W[rank][k]. One forward pass over the concatenated
+        local batches (as the loader yields them), one backward pass per real component (a single one for
+        the real code). BatchNorm statistics are taken over the concatenated batch instead of every batch separately
+        returns (coded grads in model parameter order, logits, mean loss)
+        '''
+        X_batch, y_batch = Variable(train_image_batch), Variable(train_label_batch)
+        self.network.train()
+        logits = self.network(X_batch)
+        # per sample cross entropy, the batch losses are means over their samples
+        sample_losses = -F.log_softmax(logits, dim=1).gather(1, y_batch.long().view(-1, 1)).view(-1)
+        coefs = self._W[self.rank-1][np.where(self._fake_W[self.rank-1]!=0)[0][0:self._hat_s]]
+        components = [np.real(coefs)]
+        if np.iscomplexobj(coefs):
+            components.append(np.imag(coefs))
+        coded_grads = None
+        for c_idx, component in enumerate(components):
+            sample_weights = np.repeat(component/float(self.batch_size), self.batch_size).astype(np.float32)
+            weighted_loss = (sample_losses*Variable(torch.from_numpy(sample_weights))).sum()
+            self.optimizer.zero_grad()
+            weighted_loss.backward(retain_graph=(c_idx < len(components)-1))
+            if coded_grads is None:
+                coded_grads = [p.grad.data.numpy().astype(self._W.dtype) for p in self.network.parameters()]
+            else:
+                for coded_grad, p in zip(coded_grads, self.network.parameters()):
+                    coded_grad.imag = p.grad.data.numpy()
+        return coded_grads, logits, sample_losses.mean()
+
+    def _encode_grads(self):
+        '''
+        linear combination of the gradients of all layers over all local batches, a single
+        (D, hat_s) x (hat_s, 2) product into the flat coded buffer, returned as per-layer views
+        '''
+        np.dot(self._local_grads.T, self._coef_matrix, out=self._coded_view)
+        return [self._coded_buf[start:end].reshape(shape) for start, end, shape in
+                    zip(self._param_offsets[:-1], self._param_offsets[1:], self._param_shapes)]
@@ -36,6 +36,25 @@ class CodedWorker(DistributedWorker):
         self._group_num = kwargs['group_num'] # which group this worker belongs to
         self._group_size = len(self._group_list[0])
         self._compress_grad = kwargs['compress_grad']
+        self._bucket_grad = kwargs['bucket_grad']
+        self._bucket_cap_mb = kwargs['bucket_cap_mb']
+        self._persistent_comm = kwargs['persistent_comm'] and (self._compress_grad == 'None' or self._bucket_grad)
+        self._grad_sender = None
+        self._bucket_requests = None
+        # dtype weights and gradients travel in
+        self._wire = WireFormat(kwargs['wire_dtype'])
+        # codec behind every compressed gradient sent by this worker
+        self._compressor = init_compressor(kwargs)
+        # how this worker waits for the next step while master aggregates
+        self._step_notifier = StepNotifier(comm, policy=kwargs['wait_policy'], max_sleep=kwargs['wait_max_sleep'])
+        # step and weights in one message with comm-type Packet, `_model_version` is the version loaded into the model
+        self._model_packet = None
+        self._model_version = -1
+        # broadcast of the next packet posted ahead of time and when it was posted
+        self._packet_request = None
+        self._packet_posted = 0
+        # parameters alias the float32 weights of the packet, only with comm-type Packet and wire-dtype float32
+        self._zero_copy_model = kwargs['zero_copy_model'] and self.comm_type == "Packet" and self._wire.name == 'float32'
         # this one is going to be used to avoid fetch the weights for multiple times
         self._layer_cur_step = []
 
@@ -57,6 +76,7 @@ class CodedWorker(DistributedWorker):
         self.criterion = nn.CrossEntropyLoss()
         # assign a buffer for receiving models from parameter server
         self.init_recv_buf()
+        self.init_bucket()
         #self._param_idx = len(self.network.full_modules)*2-1
         self._param_idx = self.network.fetch_init_channel_index-1
 
@@ -103,6 +123,7 @@ class CodedWorker(DistributedWorker):
                     # the real start point of this iteration
                     iter_start_time = time.time()
                     first = False
+                    wait_duration = self._step_notifier.take_wait()
                     should_enter_next = False
                     print("Rank of this node: {}, Current step: {}".format(self.rank, self.cur_step))
                     # TODO(hwang): return layer request here and do weight before the forward step begins, rather 
@@ -112,6 +133,8 @@ class CodedWorker(DistributedWorker):
                         self.async_fetch_weights_bcast()
                     elif self.comm_type == "Async":
                         self.async_fetch_weights_async()
+                    elif self.comm_type == "Packet":
+                        self.apply_model_packet()
                     fetch_weight_duration = time.time() - fetch_weight_start_time
 
                     self.network.train()
@@ -141,10 +164,12 @@ class CodedWorker(DistributedWorker):
                     c_start = time.time()
                     self._send_grads(grads)
                     c_duration = time.time() - c_start
+                    # the next model packet arrives while the next batch is loaded
+                    self.post_model_packet()
 
-                    print('Worker: {}, Step: {}, Epoch: {} [{}/{} ({:.0f}%)], Loss: {:.4f}, Time Cost: {:.4f}, Comp: {:.4f}, Comm: {:.4f}, Prec@1: {}, Prec@5: {}'.format(self.rank,
+                    print('Worker: {}, Step: {}, Epoch: {} [{}/{} ({:.0f}%)], Loss: {:.4f}, Time Cost: {:.4f}, Comp: {:.4f}, Comm: {:.4f}, Wait: {:.4f}, Prec@1: {}, Prec@5: {}'.format(self.rank,
                          self.cur_step, num_epoch, batch_idx * self.batch_size, len(train_loader.dataset), 
-                            (100. * (batch_idx * self.batch_size) / len(train_loader.dataset)), loss.data[0], time.time()-iter_start_time, computation_time, c_duration+fetch_weight_duration, prec1.numpy()[0], prec5.numpy()[0]))
+                            (100. * (batch_idx * self.batch_size) / len(train_loader.dataset)), loss.data[0], time.time()-iter_start_time, computation_time, c_duration+fetch_weight_duration, wait_duration, prec1.numpy()[0], prec5.numpy()[0]))
                     if self.cur_step%self._eval_freq == 0 and self.rank==1:
                         #self._save_model(file_path=self._generate_model_path())
                         if "ResNet" in self.network_config:
@@ -155,6 +180,13 @@ class CodedWorker(DistributedWorker):
                     break
 
     def _send_grads(self, grads):
+        if self._bucket_grad:
+            # `grads` comes out of `backward_coded` in reversed parameter order
+            self._send_bucket(list(reversed(grads)))
+            return
+        if self._persistent_comm:
+            self._send_grads_persistent(list(reversed(grads)))
+            return
         req_send_check = []
         for i, grad in enumerate(reversed(grads)):
             if len(req_send_check) != 0:
@@ -162,16 +194,16 @@ class CodedWorker(DistributedWorker):
             if self.rank in self._fail_workers[self.cur_step]:
                 simulation_grad = err_simulation(grad, self._err_mode)
                 if self._compress_grad=='compress':
-                    _compressed_grad = compress(simulation_grad)
-                    req_isend = self.comm.isend(_compressed_grad, dest=0, tag=88+i)
+                    _compressed_grad = compress(self._wire.cast(simulation_grad))
+                    req_isend = self.comm.Isend([_compressed_grad, MPI.BYTE], dest=0, tag=88+i)
                 else:
-                    req_isend = self.comm.Isend([simulation_grad, MPI.DOUBLE], dest=0, tag=88+i)
+                    req_isend = self.comm.Isend([self._wire.cast(simulation_grad), self._wire.mpi_type], dest=0, tag=88+i)
                 req_send_check.append(req_isend)
             else:
                 if self._compress_grad=='compress':
-                    _compressed_grad = compress(grad)
-                    req_isend = self.comm.isend(_compressed_grad, dest=0, tag=88+i)
+                    _compressed_grad = compress(self._wire.cast(grad))
+                    req_isend = self.comm.Isend([_compressed_grad, MPI.BYTE], dest=0, tag=88+i)
                 else:
-                    req_isend = self.comm.Isend([grad, MPI.DOUBLE], dest=0, tag=88+i)
+                    req_isend = self.comm.Isend([self._wire.cast(grad), self._wire.mpi_type], dest=0, tag=88+i)
                 req_send_check.append(req_isend)
         req_send_check[-1].wait()
\ No newline at end of file
@@ -5,17 +5,26 @@ import numpy as np
 import sys
 sys.path.append("..")
 from nn_ops import NN_Trainer
-from compress_gradient import compress
-from datasets.utils import get_batch
+from compress_gradient import compress, use_compressor
+from bucket_gradient import GradientBucket, BUCKET_TAG_
+from wire_format import WireFormat
+from model_packet import ModelPacket
+from datasets.utils import get_batch, cyclic_batch_loader
 from util import *
 
 import torch
 from torch.autograd import Variable
+import torch.nn.functional as F
 
 import time
+import threading
 from datetime import datetime
 import copy
 from sys import getsizeof
+try:
+    import Queue as queue
+except ImportError:
+    import queue
 
 STEP_START_ = 1
 
@@ -34,18 +43,205 @@ def accuracy(output, target, topk=(1,)):
         res.append(correct_k.mul_(100.0 / batch_size))
     return res
 
+def init_compressor(kwargs):
+    '''select the codec behind `compress` for this worker from the `--compressor` options'''
+    options = {'clevel':kwargs['compress_level'], 'shuffle':kwargs['compress_shuffle'],
+                'typesize':kwargs['compress_typesize'], 'nthreads':kwargs['compress_threads']}
+    if kwargs['compressor'] == 'auto':
+        options['target_mbps'] = kwargs['compress_target_mbps']
+    return use_compressor(kwargs['compressor'], **options)
+
 class ModelBuffer(object):
-    def __init__(self, network):
+    def __init__(self, network, wire=None):
         """
         this class is used to save model weights received from parameter server
         current step for each layer of model will also be updated here to make sure
-        the model is always up-to-date
+        the model is always up-to-date. Weights are received in the wire dtype into
+        `recv_buf` and decoded once into `model_buf` when the wire dtype is 16-bit
         """
+        self.wire = WireFormat() if wire is None else wire
         self.recv_buf = []
+        self.model_buf = []
         self.layer_cur_step = []
         # consider we don't want to update the param of `BatchNorm` layer right now
         # we temporirially deprecate the foregoing version and only update the model
         # parameters
         for param_idx, param in enumerate(network.parameters()):
-            self.recv_buf.append(np.zeros(param.size()))
-            self.layer_cur_step.append(0)
\ No newline at end of file
+            self.recv_buf.append(np.zeros(param.size(), dtype=self.wire.dtype))
+            if self.wire.needs_decode:
+                self.model_buf.append(np.zeros(param.size(), dtype=self.wire.compute_dtype))
+            else:
+                self.model_buf.append(self.recv_buf[-1])
+            self.layer_cur_step.append(0)
+        # persistent receives bound to `recv_buf`, see `init_requests`
+        self.recv_requests = None
+
+    def init_requests(self, comm, comm_type):
+        '''
+        bind every layer buffer once to a persistent receive (`Async`) or to a persistent
+        broadcast (`Bcast`, only where MPI-4 is available, otherwise this stays empty)
+        '''
+        self.recv_requests = []
+        if comm_type == "Bcast" and persistent_bcast_supported():
+            self.recv_requests = [comm.Bcast_init([buf, self.wire.mpi_type], root=0) for buf in self.recv_buf]
+        elif comm_type == "Async":
+            self.recv_requests = [comm.Recv_init([buf, self.wire.mpi_type], source=0, tag=11+layer_idx) for layer_idx, buf in enumerate(self.recv_buf)]
+
+    def decode(self, layer_idx):
+        '''weights of layer `layer_idx` in the compute dtype, ready to be loaded into the model'''
+        if not self.wire.needs_decode:
+            return self.recv_buf[layer_idx]
+        return self.wire.decode(self.recv_buf[layer_idx], self.model_buf[layer_idx])
+
+
+class GradientSendBuffer(object):
+    def __init__(self, comm, shapes, dest=0, wire=None):
+        """
+        preallocated send buffer (in the wire dtype) for every layer, each one bound once to a
+        persistent send on the per-layer tag master listens on, so a step only encodes gradients
+        in and restarts the requests
+        """
+        self.wire = WireFormat() if wire is None else wire
+        self.send_buf = [np.zeros(shape, dtype=self.wire.dtype) for shape in shapes]
+        self.requests = [comm.Send_init([buf, self.wire.mpi_type], dest=dest, tag=88+layer_idx) for layer_idx, buf in enumerate(self.send_buf)]
+
+    def send(self, grads):
+        for buf, grad in zip(self.send_buf, grads):
+            self.wire.encode(grad, buf)
+        MPI.Prequest.Startall(self.requests)
+        MPI.Request.Waitall(self.requests)
+
+
+class StepNotifier(object):
+    def __init__(self, comm, policy="block", min_sleep=5e-5, max_sleep=5e-3):
+        """
+        waits for the step messages (tag 10) parameter server sends at the start of every step.
+        `policy` decides how an idle worker waits:
+            block: blocking receive, lowest latency but most MPI libraries spin on the core meanwhile
+            backoff: probe for the message and sleep in between, the sleep doubles from `min_sleep` up to `max_sleep`
+            thread: a comm thread polls as in backoff and queues the steps, the training thread sleeps on the queue
+                    (needs MPI_THREAD_MULTIPLE, otherwise backoff is used)
+        `wait` completes a request (e.g. the model packet broadcast) under the same policy, the thread
+        policy polls it like backoff. `wait_time` counts all seconds spent waiting, `take_wait` returns
+        the ones since its last call
+        """
+        if policy == "thread" and MPI.Query_thread() < MPI.THREAD_MULTIPLE:
+            print("Step wait policy `thread` needs MPI_THREAD_MULTIPLE, falling back to `backoff`")
+            policy = "backoff"
+        assert policy in ("block", "backoff", "thread")
+        self.comm = comm
+        self.policy = policy
+        self.min_sleep = min_sleep
+        self.max_sleep = max_sleep
+        self.wait_time = 0.0
+        self._pending_wait = 0.0
+        self._steps = None
+        self._thread = None
+
+    def _poll(self):
+        '''receive the next step message, sleeping with exponential backoff until it arrives'''
+        sleep = self.min_sleep
+        while not self.comm.Iprobe(source=0, tag=10):
+            time.sleep(sleep)
+            sleep = min(2*sleep, self.max_sleep)
+        return self.comm.recv(source=0, tag=10)
+
+    def _comm_loop(self):
+        while True:
+            self._steps.put(self._poll())
+
+    def fetch(self):
+        '''the next step sent by parameter server'''
+        wait_start = time.time()
+        if self.policy == "block":
+            step = self.comm.recv(source=0, tag=10)
+        elif self.policy == "backoff":
+            step = self._poll()
+        else:
+            if self._thread is None:
+                self._steps = queue.Queue()
+                self._thread = threading.Thread(target=self._comm_loop)
+                self._thread.daemon = True
+                self._thread.start()
+            step = self._steps.get()
+        duration = time.time() - wait_start
+        self.wait_time += duration
+        self._pending_wait += duration
+        return step
+
+    def wait(self, request):
+        '''complete `request`, returns its status'''
+        wait_start = time.time()
+        status = MPI.Status()
+        if self.policy == "block":
+            request.Wait(status)
+        else:
+            sleep = self.min_sleep
+            while not request.Test(status):
+                time.sleep(sleep)
+                sleep = min(2*sleep, self.max_sleep)
+        duration = time.time() - wait_start
+        self.wait_time += duration
+        self._pending_wait += duration
+        return status
+
+    def take_wait(self):
+        duration = self._pending_wait
+        self._pending_wait = 0.0
+        return duration
+
+
+class GradientStreamer(object):
+    def __init__(self, comm, network, bucket, dest=0):
+        """
+        streams the gradients of any `nn.Module` to parameter server while backward still runs: a hook
+        on every parameter packs its gradient into the flat buffer of `bucket` as soon as autograd has
+        it, and a bucket is sent (nonblocking) once all of its layers are in. Backward produces gradients
+        last layer first, so the last bucket leaves first while the earlier layers are still computed
+        """
+        self.comm = comm
+        self.bucket = bucket
+        self.dest = dest
+        self._layer_bucket = {}
+        for b, layers in enumerate(bucket.bucket_layers):
+            for layer_idx in layers:
+                self._layer_bucket[layer_idx] = b
+        # layers each bucket still waits for, None outside of a streamed backward pass
+        self._pending = None
+        self._err_fn = None
+        self.requests = []
+        self._handles = [param.register_hook(self._make_hook(layer_idx)) for layer_idx, param in enumerate(network.parameters())]
+
+    def _make_hook(self, layer_idx):
+        def hook(grad):
+            self._on_grad(layer_idx, grad.data.numpy())
+        return hook
+
+    def start(self, err_fn=None):
+        '''arm the hooks for the next backward pass, `err_fn` is applied to every gradient before packing'''
+        self._pending = [len(layers) for layers in self.bucket.bucket_layers]
+        self._err_fn = err_fn
+        self.requests = []
+
+    def _on_grad(self, layer_idx, grad):
+        if self._pending is None:
+            # backward pass that is not streamed
+            return
+        if self._err_fn is not None:
+            grad = self._err_fn(grad)
+        view = self.bucket.layer_view(self.bucket.flat_buf, layer_idx)
+        if self.bucket.wire is None:
+            view[...] = grad
+        else:
+            self.bucket.wire.encode(grad, view)
+        b = self._layer_bucket[layer_idx]
+        self._pending[b] -= 1
+        if self._pending[b] == 0:
+            start, end = self.bucket.bucket_ranges[b]
+            self.requests.append(self.comm.Isend([self.bucket.flat_buf[start:end], self.bucket.mpi_type], dest=self.dest, tag=BUCKET_TAG_+b))
+
+    def finish(self):
+        '''wait for the bucket sends of this backward pass, every parameter must have got its gradient'''
+        assert all(pending == 0 for pending in self._pending), "not every parameter got a gradient in this backward pass"
+        MPI.Request.Waitall(self.requests)
+        self._pending = None